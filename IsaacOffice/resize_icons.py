@@ -2,14 +2,48 @@
 """
 Icon Resizer Script
 Takes a 128x128 pixel icon and creates smaller versions (16, 32, 64, 80 pixels)
+
+Requires Pillow. For faster LANCZOS resizing, Pillow-SIMD (a drop-in
+replacement with SSE4/AVX2 resampling kernels) can optionally be built
+in its place; it ships no wheels, so this needs a C compiler and the
+libjpeg/zlib headers:
+
+    pip uninstall -y pillow
+    CC="cc -mavx2" pip install -U --force-reinstall pillow-simd
 """
 
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import argparse
 
-def resize_icon(input_path, output_dir="appPackage/assets", sizes=[16, 32, 64, 80]):
+# Optional vectorized PNG encoder (falls back to Pillow's zlib encoder)
+try:
+    import fpnge
+    FPNGE_AVAILABLE = True
+except ImportError:
+    FPNGE_AVAILABLE = False
+
+def save_png(image, output_path, compress_level=1):
+    """
+    Save an image as PNG, using fpnge when it is installed
+    
+    Args:
+        image (Image): Image to save
+        output_path (str): Destination file path
+        compress_level (int): PNG zlib compression level for the Pillow fallback
+    """
+    if FPNGE_AVAILABLE:
+        # fpnge only encodes 8-bit grayscale/RGB images with optional alpha
+        if image.mode not in ("L", "LA", "RGB", "RGBA"):
+            image = image.convert("RGBA")
+        with open(output_path, "wb") as f:
+            f.write(fpnge.fromPIL(image))
+    else:
+        image.save(output_path, "PNG", compress_level=compress_level)
+
+def resize_icon(input_path, output_dir="appPackage/assets", sizes=[16, 32, 64, 80], compress_level=1):
     """
     Resize a 128x128 icon to multiple sizes
     
@@ -17,6 +51,7 @@ def resize_icon(input_path, output_dir="appPackage/assets", sizes=[16, 32, 64, 8
         input_path (str): Path to the input 128x128 icon
         output_dir (str): Directory to save resized icons
         sizes (list): List of target sizes in pixels
+        compress_level (int): PNG zlib compression level (0-9)
     """
     
     # Check if input file exists
@@ -42,18 +77,36 @@ def resize_icon(input_path, output_dir="appPackage/assets", sizes=[16, 32, 64, 8
             if base_name.endswith("-128"):
                 base_name = base_name[:-4]
             
-            # Resize to each target size
-            for size in sizes:
-                # Resize image with high quality resampling
-                resized = img.resize((size, size), Image.Resampling.LANCZOS)
-                
-                # Create output filename using base name
-                output_filename = f"{base_name}-{size}.png"
-                output_path = os.path.join(output_dir, output_filename)
+            # Resize progressively from largest to smallest, reusing each
+            # result as the source for the next size so the resampler
+            # reads far fewer source pixels for the small icons
+            # The PNG encodes are independent and Pillow releases the GIL
+            # while encoding, so they run on a thread pool and overlap with
+            # the remaining resizes
+            # Pillow premultiplies alpha before each LANCZOS resize of an
+            # RGBA/LA image and reverts it afterwards. Premultiply once up
+            # front so the chained resizes run directly on premultiplied
+            # pixels, and only convert back for each saved icon.
+            premultiplied_mode = {"RGBA": "RGBa", "LA": "La"}.get(img.mode)
+            current = img.convert(premultiplied_mode) if premultiplied_mode else img
+            with ThreadPoolExecutor(max_workers=len(sizes)) as executor:
+                pending = []
+                for size in sorted(sizes, reverse=True):
+                    # Resize image with high quality resampling
+                    current = current.resize((size, size), Image.Resampling.LANCZOS)
+                    
+                    # Create output filename using base name
+                    output_filename = f"{base_name}-{size}.png"
+                    output_path = os.path.join(output_dir, output_filename)
+                    
+                    # Save the resized image
+                    output = current.convert(img.mode) if premultiplied_mode else current
+                    future = executor.submit(save_png, output, output_path, compress_level)
+                    pending.append((future, output_path))
                 
-                # Save the resized image
-                resized.save(output_path, "PNG", optimize=True)
-                print(f"Created: {output_path}")
+                for future, output_path in pending:
+                    future.result()
+                    print(f"Created: {output_path}")
             
             print(f"Successfully created {len(sizes)} resized icons from {input_path}")
             return True
@@ -69,10 +122,13 @@ def main():
                        help="Output directory (default: appPackage/assets)")
     parser.add_argument("-s", "--sizes", nargs="+", type=int, default=[16, 32, 64, 80],
                        help="Target sizes in pixels (default: 16 32 64 80)")
+    parser.add_argument("-c", "--compress-level", type=int, default=1, choices=range(10),
+                       metavar="0-9",
+                       help="PNG compression level when fpnge is not installed (default: 1)")
     
     args = parser.parse_args()
     
-    success = resize_icon(args.input_file, args.output, args.sizes)
+    success = resize_icon(args.input_file, args.output, args.sizes, args.compress_level)
     sys.exit(0 if success else 1)
 
 if __name__ == "__main__":
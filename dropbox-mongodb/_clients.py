@@ -0,0 +1,103 @@
+"""
+Shared clients for the admin and test scripts
+
+Each client is created on first use and reused for the rest of the
+process, so a script pays the TLS handshake and MongoDB topology
+discovery once no matter how many helpers touch the same service.
+Clients are closed automatically at interpreter exit.
+
+The SDKs are imported inside the getters, so a script that exits early
+(e.g. on a missing connection string) never pays their import cost.
+"""
+
+import atexit
+from functools import lru_cache
+from typing import TYPE_CHECKING
+
+from _env import load_env
+
+if TYPE_CHECKING:
+    from bson import ObjectId
+    from pymongo import MongoClient
+    from azure.storage.blob import BlobServiceClient
+    from azure.servicebus import ServiceBusClient, ServiceBusSender
+    from azure.servicebus.management import ServiceBusAdministrationClient
+
+
+@lru_cache(maxsize=1)
+def get_mongo_client() -> "MongoClient":
+    """Get the shared MongoDB client (MONGODB_URI)"""
+    from pymongo import MongoClient
+    
+    client = MongoClient(
+        load_env().MONGODB_URI,
+        maxPoolSize=20,
+        minPoolSize=1,
+        serverSelectionTimeoutMS=3000
+    )
+    atexit.register(client.close)
+    return client
+
+
+def get_database():
+    """Get the isaac-dropbox database (MONGODB_DATABASE)"""
+    return get_mongo_client()[load_env().MONGODB_DATABASE]
+
+
+@lru_cache(maxsize=4096)
+def oid(file_id: str) -> "ObjectId":
+    """Parse a file ID string into an ObjectId, reusing earlier results"""
+    from bson import ObjectId
+    
+    return ObjectId(file_id)
+
+
+@lru_cache(maxsize=1)
+def get_blob_service_client() -> "BlobServiceClient":
+    """Get the shared Blob Storage client (BLOB_CONNECTION_STRING)"""
+    from azure.storage.blob import BlobServiceClient
+    
+    # Anything over 8MB is uploaded as 8MB blocks, which upload_blob can
+    # send in parallel (max_concurrency) instead of as one long PUT
+    client = BlobServiceClient.from_connection_string(
+        load_env().BLOB_CONNECTION_STRING,
+        max_block_size=8 * 1024 * 1024,
+        max_single_put_size=8 * 1024 * 1024
+    )
+    atexit.register(client.close)
+    return client
+
+
+@lru_cache(maxsize=1)
+def get_servicebus_client() -> "ServiceBusClient":
+    """Get the shared Service Bus client (SERVICE_BUS_CONNECTION_STRING)"""
+    from azure.servicebus import ServiceBusClient
+    
+    client = ServiceBusClient.from_connection_string(load_env().SERVICE_BUS_CONNECTION_STRING)
+    atexit.register(client.close)
+    return client
+
+
+@lru_cache(maxsize=1)
+def get_servicebus_admin_client() -> "ServiceBusAdministrationClient":
+    """Get the shared Service Bus management client (SERVICE_BUS_CONNECTION_STRING)"""
+    from azure.servicebus.management import ServiceBusAdministrationClient
+    
+    client = ServiceBusAdministrationClient.from_connection_string(load_env().SERVICE_BUS_CONNECTION_STRING)
+    atexit.register(client.close)
+    return client
+
+
+@lru_cache(maxsize=None)
+def get_servicebus_sender(queue_name: str) -> "ServiceBusSender":
+    """
+    Get the shared sender for a Service Bus queue (its link opens on first use)
+    
+    The scripts finish well within Service Bus' idle timeout, so the link
+    is not kept alive in the background; if it is ever detached while
+    idle, the SDK reopens it on the next send.
+    """
+    sender = get_servicebus_client().get_queue_sender(queue_name=queue_name)
+    # Registered after the client, so atexit closes the sender first
+    atexit.register(sender.close)
+    return sender
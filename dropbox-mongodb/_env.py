@@ -0,0 +1,31 @@
+"""
+Environment settings for the admin and test scripts
+
+Settings are read from worker/.env (falling back to the process
+environment) once per process and shared by every script and helper.
+"""
+
+import os
+from functools import cache
+from pathlib import Path
+from types import SimpleNamespace
+
+from dotenv import load_dotenv
+
+ENV_PATH = Path(__file__).parent / "worker" / ".env"
+
+
+@cache
+def load_env() -> SimpleNamespace:
+    """Load worker/.env once and return the settings used by the scripts"""
+    if ENV_PATH.exists():
+        load_dotenv(ENV_PATH)
+    
+    return SimpleNamespace(
+        MONGODB_URI=os.getenv("MONGODB_URI"),
+        MONGODB_DATABASE=os.getenv("MONGODB_DATABASE", "isaac-dropbox"),
+        BLOB_CONNECTION_STRING=os.getenv("BLOB_CONNECTION_STRING"),
+        BLOB_CONTAINER_NAME=os.getenv("BLOB_CONTAINER_NAME", "dropbox"),
+        SERVICE_BUS_CONNECTION_STRING=os.getenv("SERVICE_BUS_CONNECTION_STRING"),
+        SERVICE_BUS_QUEUE_NAME=os.getenv("SERVICE_BUS_QUEUE_NAME", "dropbox-file-processing")
+    )
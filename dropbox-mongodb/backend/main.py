@@ -21,6 +21,7 @@ from dotenv import load_dotenv
 from .routes import dropbox, rag
 from .services.dropbox_service import DropboxService
 from .services.queue_service import QueueService
+from .services.embedding_cache import EmbeddingCache, REDIS_AVAILABLE
 
 # Load environment variables
 load_dotenv()
@@ -32,6 +33,113 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Atlas Vector Search index used by /api/rag/search
+VECTOR_INDEX_NAME = "vector_index"
+
+
+# Server-side vector quantization: "scalar" (int8), "binary" or "none".
+# Atlas keeps the full-fidelity vectors on disk and rescores with them, so
+# this only shrinks the in-memory HNSW graph scanned by $vectorSearch
+VECTOR_INDEX_QUANTIZATION = os.getenv("VECTOR_INDEX_QUANTIZATION", "scalar")
+
+
+def build_vector_search_index(dimensions: int, similarity: str) -> dict:
+    """Build the vectorSearch index definition for dropbox_chunks"""
+    vector_field = {
+        "type": "vector",
+        "path": "embedding",
+        "numDimensions": dimensions,
+        "similarity": similarity
+    }
+    if VECTOR_INDEX_QUANTIZATION != "none":
+        vector_field["quantization"] = VECTOR_INDEX_QUANTIZATION
+    
+    return {
+        "name": VECTOR_INDEX_NAME,
+        "type": "vectorSearch",
+        "definition": {
+            "fields": [
+                vector_field,
+                {"type": "filter", "path": "file_type"},
+                {"type": "filter", "path": "file_id"}
+            ]
+        }
+    }
+
+
+async def ensure_vector_search_index(db):
+    """
+    Migrate a legacy knnVector Atlas Search index to a vectorSearch index
+    
+    The RAG search uses the $vectorSearch stage, which only works against
+    vectorSearch-type indexes. An existing vectorSearch index is updated
+    in place when its quantization differs from VECTOR_INDEX_QUANTIZATION.
+    Failures are logged rather than raised so the backend still starts
+    (search then falls back to text search).
+    """
+    try:
+        indexes = await db.dropbox_chunks.list_search_indexes(VECTOR_INDEX_NAME).to_list(length=None)
+    except Exception as e:
+        logger.warning(f"Could not list Atlas Search indexes (not on Atlas?): {e}")
+        return
+    
+    if not indexes:
+        logger.warning(f"Vector search index '{VECTOR_INDEX_NAME}' not found on dropbox_chunks")
+        return
+    
+    index = indexes[0]
+    if index.get("type") == "vectorSearch":
+        fields = index.get("latestDefinition", {}).get("fields", [])
+        vector_field = next((f for f in fields if f.get("type") == "vector"), {})
+        quantization = vector_field.get("quantization", "none")
+        if not vector_field or quantization == VECTOR_INDEX_QUANTIZATION:
+            logger.info(f"✓ Vector search index '{VECTOR_INDEX_NAME}' found")
+            return
+        
+        logger.info(
+            f"Updating vector search index '{VECTOR_INDEX_NAME}' quantization: "
+            f"{quantization} -> {VECTOR_INDEX_QUANTIZATION}"
+        )
+        try:
+            await db.command({
+                "updateSearchIndex": "dropbox_chunks",
+                "name": VECTOR_INDEX_NAME,
+                "definition": build_vector_search_index(
+                    vector_field.get("numDimensions", 3072),
+                    vector_field.get("similarity", "cosine")
+                )["definition"]
+            })
+            logger.info(f"✓ Vector search index '{VECTOR_INDEX_NAME}' updated (rebuilds in background)")
+        except Exception as e:
+            logger.error(f"Failed to update vector search index '{VECTOR_INDEX_NAME}': {e}")
+        return
+    
+    # Legacy Atlas Search index with a knnVector field mapping
+    fields = index.get("latestDefinition", {}).get("mappings", {}).get("fields", {})
+    embedding_field = fields.get("embedding", {})
+    if embedding_field.get("type") != "knnVector":
+        logger.warning(f"Search index '{VECTOR_INDEX_NAME}' is not a vector index, leaving it unchanged")
+        return
+    
+    logger.info(f"Migrating legacy knnVector index '{VECTOR_INDEX_NAME}' to vectorSearch...")
+    try:
+        await db.command({
+            "dropSearchIndex": "dropbox_chunks",
+            "name": VECTOR_INDEX_NAME
+        })
+        await db.command({
+            "createSearchIndexes": "dropbox_chunks",
+            "indexes": [
+                build_vector_search_index(
+                    embedding_field.get("dimensions", 3072),
+                    embedding_field.get("similarity", "cosine")
+                )
+            ]
+        })
+        logger.info(f"✓ Vector search index '{VECTOR_INDEX_NAME}' recreated as vectorSearch (builds in background)")
+    except Exception as e:
+        logger.error(f"Failed to migrate vector search index '{VECTOR_INDEX_NAME}': {e}")
+
 
 # Application lifespan for startup/shutdown
 @asynccontextmanager
@@ -58,6 +166,16 @@ async def lifespan(app: FastAPI):
         logger.error(f"Failed to connect to MongoDB: {e}")
         raise
     
+    # Ensure indexes exist (idempotent, safe to run on every startup)
+    await db.dropbox_files.create_index("dropbox_file_id", unique=True)
+    await db.dropbox_files.create_index([("processing_status", 1), ("_id", -1)])
+    await db.dropbox_files.create_index([("file_hash", 1), ("dropbox_path", 1)])
+    await db.dropbox_chunks.create_index([("file_id", 1), ("chunk_index", 1)])
+    await db.dropbox_chunks.create_index([("content", "text")])
+    await db.dropbox_chunks.create_index("text_hash")
+    logger.info("✓ MongoDB indexes ensured")
+    await ensure_vector_search_index(db)
+    
     # Initialize Dropbox service
     dropbox_access_token = os.getenv("DROPBOX_ACCESS_TOKEN")
     dropbox_app_key = os.getenv("DROPBOX_APP_KEY")
@@ -94,6 +212,8 @@ async def lifespan(app: FastAPI):
         raise ValueError("BLOB_CONNECTION_STRING environment variable is required")
     
     blob_service = BlobServiceClient.from_connection_string(blob_connection)
+    blob_container_name = os.getenv("BLOB_CONTAINER_NAME", "dropbox")
+    blob_container = blob_service.get_container_client(blob_container_name)
     logger.info("✓ Blob storage service initialized")
     
     # Initialize Azure OpenAI client
@@ -110,17 +230,36 @@ async def lifespan(app: FastAPI):
         api_version=azure_openai_api_version,
         azure_endpoint=azure_openai_endpoint
     )
-    # Store deployment name for embeddings
-    openai_client._custom_query = {"deployment_name": openai_embedding_model}
     logger.info("✓ Azure OpenAI client initialized")
     
+    # Initialize embedding cache (Redis L2 is optional)
+    redis_url = os.getenv("REDIS_URL")
+    redis_client = None
+    
+    if redis_url and REDIS_AVAILABLE:
+        from redis.asyncio import BlockingConnectionPool, Redis
+        redis_pool = BlockingConnectionPool.from_url(
+            redis_url,
+            max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", "20"))
+        )
+        redis_client = Redis(connection_pool=redis_pool)
+    elif redis_url:
+        logger.warning("REDIS_URL is set but redis is not installed; using in-process cache only")
+    
+    embedding_cache = EmbeddingCache(redis_client=redis_client)
+    logger.info(f"✓ Embedding cache initialized ({'Redis + in-process' if redis_client else 'in-process'})")
+    
     # Store services in app state
     app.state.db = db
     app.state.mongo_client = mongo_client
     app.state.dropbox_service = dropbox_service
     app.state.queue_service = queue_service
     app.state.blob_service = blob_service
+    app.state.blob_container_name = blob_container_name
+    app.state.blob_container = blob_container
     app.state.openai_client = openai_client
+    app.state.embedding_deployment = openai_embedding_model
+    app.state.embedding_cache = embedding_cache
     
     logger.info("=" * 60)
     logger.info("Dropbox RAG Backend Started Successfully!")
@@ -134,6 +273,7 @@ async def lifespan(app: FastAPI):
     # Close connections
     await queue_service.disconnect()
     await blob_service.close()
+    await embedding_cache.close()
     mongo_client.close()
     
     logger.info("✓ Shutdown complete")
@@ -171,6 +311,7 @@ async def root():
             "dropbox_sync": "/api/dropbox/sync",
             "dropbox_files": "/api/dropbox/files",
             "rag_search": "/api/rag/search",
+            "rag_search_batch": "/api/rag/search_batch",
             "rag_health": "/api/rag/health",
             "docs": "/docs"
         }
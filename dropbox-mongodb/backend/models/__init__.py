@@ -10,6 +10,7 @@ from .dropbox_file import (
 )
 from .rag_models import (
     RAGSearchRequest,
+    RAGBatchSearchRequest,
     RAGSearchResult,
     RAGSearchResponse,
     SyncRequest,
@@ -24,6 +25,7 @@ __all__ = [
     "DropboxFileListResponse",
     "DropboxChunkResponse",
     "RAGSearchRequest",
+    "RAGBatchSearchRequest",
     "RAGSearchResult",
     "RAGSearchResponse",
     "SyncRequest",
@@ -17,6 +17,16 @@ class RAGSearchRequest(BaseModel):
     include_content: bool = Field(default=True, description="Include chunk content in response")
 
 
+class RAGBatchSearchRequest(BaseModel):
+    """Request model for batched RAG search (same options applied to every query)"""
+    queries: List[str] = Field(..., min_length=1, max_length=32, description="Search query texts")
+    top_k: int = Field(default=10, ge=1, le=100, description="Number of results to return per query")
+    file_types: Optional[List[str]] = Field(default=None, description="Filter by file types (e.g., ['pdf', 'docx'])")
+    file_ids: Optional[List[str]] = Field(default=None, description="Filter by specific file IDs")
+    min_score: Optional[float] = Field(default=None, ge=0.0, le=1.0, description="Minimum similarity score")
+    include_content: bool = Field(default=True, description="Include chunk content in response")
+
+
 class RAGSearchResult(BaseModel):
     """Single search result from RAG query"""
     chunk_id: str
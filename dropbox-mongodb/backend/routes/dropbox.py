@@ -2,54 +2,258 @@
 Dropbox routes for manual sync and file management
 """
 
-import os
+import re
+import asyncio
 import logging
 import hashlib
-from typing import Optional
+import tempfile
+from typing import Optional, Dict, Any
 from datetime import datetime
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
+from pymongo import ReturnDocument
 
 from ..models.rag_models import SyncRequest, SyncResponse
 from ..models.dropbox_file import DropboxFileResponse, DropboxFileListResponse
-from ..services.dropbox_service import DropboxService
+from ..services.dropbox_service import DropboxService, SUPPORTED_FILE_TYPES
 from ..services.queue_service import QueueService
-from azure.storage.blob.aio import BlobServiceClient
+from azure.storage.blob.aio import BlobServiceClient, ContainerClient
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/dropbox", tags=["dropbox"])
 
+# Maximum number of files synced concurrently by manual_sync
+MAX_CONCURRENT_SYNC_FILES = 16
+
+# Number of queue messages collected before they are sent during a sync
+# (in as few size-bounded Service Bus batches as possible)
+SYNC_QUEUE_BATCH_SIZE = 100
+
+# Files larger than this are spooled to disk instead of memory while syncing
+SYNC_SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# Processing states in which an unchanged file is skipped by a sync; files
+# whose processing failed are queued again, while files the worker skipped
+# as unprocessable (unsupported type, empty) are not
+SYNC_DEDUP_STATUSES = frozenset({"pending", "processing", "completed", "skipped"})
+
+# Valid MongoDB ObjectId string (24 hex characters, used with fullmatch)
+_OBJECT_ID_RE = re.compile(r"[0-9a-fA-F]{24}")
+
+# Fields needed to build a DropboxFileResponse
+FILE_RESPONSE_PROJECTION = {
+    "dropbox_path": 1,
+    "filename": 1,
+    "file_type": 1,
+    "processing_status": 1,
+    "chunk_count": 1,
+    "file_size": 1,
+    "blob_url": 1,
+    "markdown_blob_url": 1,
+    "created_at": 1,
+    "updated_at": 1
+}
+
 
 # Dependency to get MongoDB database
-async def get_database() -> AsyncIOMotorClient:
+async def get_database(request: Request) -> AsyncIOMotorClient:
     """Get MongoDB database instance"""
-    # This will be injected via app state
-    from ..main import app
-    return app.state.db
+    return request.app.state.db
 
 
 # Dependency to get Dropbox service
-async def get_dropbox_service() -> DropboxService:
+async def get_dropbox_service(request: Request) -> DropboxService:
     """Get Dropbox service instance"""
-    from ..main import app
-    return app.state.dropbox_service
+    return request.app.state.dropbox_service
 
 
 # Dependency to get Queue service
-async def get_queue_service() -> QueueService:
+async def get_queue_service(request: Request) -> QueueService:
     """Get Queue service instance"""
-    from ..main import app
-    return app.state.queue_service
+    return request.app.state.queue_service
 
 
 # Dependency to get Blob service
-async def get_blob_service() -> BlobServiceClient:
+async def get_blob_service(request: Request) -> BlobServiceClient:
     """Get Blob service instance"""
-    from ..main import app
-    return app.state.blob_service
+    return request.app.state.blob_service
+
+
+# Dependency to get Blob container client
+async def get_blob_container(request: Request) -> ContainerClient:
+    """Get Blob container client instance"""
+    return request.app.state.blob_container
+
+
+async def _sync_file(
+    file_metadata: dict,
+    existing: Optional[dict],
+    sync_request: SyncRequest,
+    db,
+    dropbox_service: DropboxService,
+    queue_service: QueueService,
+    blob_container: ContainerClient
+) -> Optional[Dict[str, Any]]:
+    """
+    Sync a single Dropbox file: deduplicate, upload to blob storage,
+    and upsert its database record
+    
+    Args:
+        file_metadata: File metadata from DropboxService.list_files
+        existing: Existing database record for the file, if any
+    
+    Returns:
+        Processing queue message body for the file, or None if it was skipped
+    """
+    try:
+        # One timestamp for every write made for this file
+        now = datetime.utcnow()
+        
+        # Check if file type is supported
+        _, dot, file_type = file_metadata["name"].rpartition(".")
+        file_type = file_type.lower() if dot else ""
+        if file_type not in SUPPORTED_FILE_TYPES:
+            logger.info(f"Skipping unsupported file type: {file_metadata['name']}")
+            return None
+        
+        # Only files still queued, in progress, already processed or skipped
+        # by the worker are deduplicated; a failed file is always queued again
+        if existing and existing.get("processing_status") not in SYNC_DEDUP_STATUSES:
+            logger.info(f"Previous processing failed, will reprocess: {file_metadata['name']}")
+            existing = None
+        
+        # Deduplication checks (fast → slow)
+        if not sync_request.force_reprocess:
+            if existing:
+                # Step 1: Quick metadata check (no download needed)
+                existing_modified = existing.get("dropbox_modified_at")
+                new_modified = file_metadata.get("server_modified")
+                
+                if existing_modified and new_modified:
+                    # If modification date hasn't changed, assume file is unchanged
+                    if existing_modified == new_modified:
+                        logger.info(f"File unchanged (metadata check): {file_metadata['name']}")
+                        return None
+                
+                # Step 2: Hash check (only if metadata suggests change)
+                dropbox_content_hash = file_metadata.get("content_hash", "")
+                if dropbox_content_hash and existing.get("metadata", {}).get("content_hash") == dropbox_content_hash:
+                    logger.info(f"File unchanged (hash check): {file_metadata['name']}")
+                    # Update modified date even though content is same (for tracking)
+                    await db.dropbox_files.update_one(
+                        {"_id": existing["_id"]},
+                        {"$set": {"dropbox_modified_at": new_modified, "updated_at": now}}
+                    )
+                    return None
+                
+                logger.info(f"File changed, will reprocess: {file_metadata['name']}")
+        
+        # Stream file from Dropbox, calculating the SHA256 hash as chunks
+        # arrive. The blob name is derived from the hash, so the content is
+        # spooled (in memory for small files, on disk for large ones) until
+        # the hash is known and the upload can start.
+        hasher = hashlib.sha256()
+        with tempfile.SpooledTemporaryFile(max_size=SYNC_SPOOL_MAX_SIZE) as spool:
+            async for chunk in dropbox_service.download_file(file_metadata["path_display"]):
+                hasher.update(chunk)
+                # Once the spool rolls over to disk, writes (including the
+                # rollover itself) are file I/O, so they run in a thread
+                # instead of blocking the other files being synced
+                if spool.tell() + len(chunk) > SYNC_SPOOL_MAX_SIZE:
+                    await asyncio.to_thread(spool.write, chunk)
+                else:
+                    spool.write(chunk)
+            sha256_hash = hasher.hexdigest()
+            
+            # Step 3: Content hash check. Dropbox metadata can change without
+            # the content changing (e.g. a rev bump on share), in which case
+            # the blob already exists under the same name and needs no upload.
+            if existing and existing.get("file_hash") == sha256_hash:
+                logger.info(f"File unchanged (content hash check): {file_metadata['name']}")
+                await db.dropbox_files.update_one(
+                    {"_id": existing["_id"]},
+                    {"$set": {
+                        "dropbox_rev": file_metadata.get("rev"),
+                        "dropbox_modified_at": file_metadata.get("server_modified"),
+                        "metadata.content_hash": file_metadata.get("content_hash"),
+                        "updated_at": now
+                    }}
+                )
+                return None
+            
+            file_length = spool.tell()
+            if file_length > SYNC_SPOOL_MAX_SIZE:
+                # Flushes buffered writes to disk
+                await asyncio.to_thread(spool.seek, 0)
+            else:
+                spool.seek(0)
+            
+            # Upload to blob storage
+            blob_name = f"dropbox/{sha256_hash}/{file_metadata['name']}"
+            blob_client = await blob_container.upload_blob(
+                name=blob_name,
+                data=spool,
+                length=file_length,
+                overwrite=True,
+                max_concurrency=4
+            )
+        
+        blob_url = blob_client.url
+        logger.info(f"Uploaded to blob storage: {blob_name}")
+        
+        # Create or update file record in MongoDB
+        file_record = {
+            "dropbox_path": file_metadata["path_display"],
+            "dropbox_file_id": file_metadata["id"],
+            "dropbox_rev": file_metadata.get("rev"),
+            "filename": file_metadata["name"],
+            "file_type": file_type,
+            "blob_url": blob_url,
+            "file_hash": sha256_hash,
+            "file_size": file_metadata["size"],
+            "user_id": "system",
+            "processing_status": "pending",
+            "chunk_count": 0,
+            "created_at": now,
+            "updated_at": now,
+            "dropbox_created_at": file_metadata.get("modified"),
+            "dropbox_modified_at": file_metadata.get("server_modified"),
+            "metadata": {
+                "folder": "/".join(file_metadata["path_display"].split("/")[:-1]),
+                # Dropbox content hash, compared by the Step 2 check on later syncs
+                "content_hash": file_metadata.get("content_hash")
+            }
+        }
+        
+        # Upsert file record, returning its ID in the same round-trip
+        record = await db.dropbox_files.find_one_and_update(
+            {"dropbox_file_id": file_metadata["id"]},
+            {"$set": file_record},
+            projection={"_id": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        file_id = str(record["_id"])
+        
+        logger.info(f"Created/updated file record: {file_id}")
+        
+        # Build message for the processing queue (sent in batches by manual_sync)
+        return queue_service.build_dropbox_processing_message(
+            file_id=file_id,
+            dropbox_path=file_metadata["path_display"],
+            dropbox_file_id=file_metadata["id"],
+            blob_url=blob_url,
+            filename=file_metadata["name"],
+            file_type=file_type,
+            user_id="system"
+        )
+        
+    except Exception as e:
+        logger.error(f"Failed to process file {file_metadata['name']}: {e}")
+        return None
 
 
 @router.post("/sync", response_model=SyncResponse)
@@ -58,7 +262,7 @@ async def manual_sync(
     db = Depends(get_database),
     dropbox_service: DropboxService = Depends(get_dropbox_service),
     queue_service: QueueService = Depends(get_queue_service),
-    blob_service: BlobServiceClient = Depends(get_blob_service)
+    blob_container: ContainerClient = Depends(get_blob_container)
 ):
     """
     Manually trigger sync for specific Dropbox path
@@ -76,134 +280,64 @@ async def manual_sync(
             file_types=sync_request.file_types
         )
         
+        # Fetch existing records for all listed files in one query
+        existing_records = {}
+        if not sync_request.force_reprocess and files:
+            cursor = db.dropbox_files.find(
+                {"dropbox_file_id": {"$in": [fm["id"] for fm in files]}}
+            )
+            existing_records = {
+                record["dropbox_file_id"]: record async for record in cursor
+            }
+        
+        # Queue messages are collected and sent in batches
+        pending_messages = []
         files_queued = 0
-        files_skipped = 0
         
-        for file_metadata in files:
-            try:
-                # Check if file type is supported
-                file_type = dropbox_service.get_file_extension(file_metadata["name"])
-                if not dropbox_service.is_supported_file_type(file_type):
-                    logger.info(f"Skipping unsupported file type: {file_metadata['name']}")
-                    files_skipped += 1
-                    continue
-                
-                # Two-step deduplication check (fast → slow)
-                if not sync_request.force_reprocess:
-                    existing = await db.dropbox_files.find_one({
-                        "dropbox_file_id": file_metadata["id"]
-                    })
-                    
-                    if existing:
-                        # Step 1: Quick metadata check (no download needed)
-                        existing_modified = existing.get("dropbox_modified_at")
-                        new_modified = file_metadata.get("server_modified")
-                        
-                        if existing_modified and new_modified:
-                            # If modification date hasn't changed, assume file is unchanged
-                            if existing_modified == new_modified:
-                                logger.info(f"File unchanged (metadata check): {file_metadata['name']}")
-                                files_skipped += 1
-                                continue
-                        
-                        # Step 2: Hash check (only if metadata suggests change)
-                        dropbox_content_hash = file_metadata.get("content_hash", "")
-                        if dropbox_content_hash and existing.get("metadata", {}).get("content_hash") == dropbox_content_hash:
-                            logger.info(f"File unchanged (hash check): {file_metadata['name']}")
-                            # Update modified date even though content is same (for tracking)
-                            await db.dropbox_files.update_one(
-                                {"_id": existing["_id"]},
-                                {"$set": {"dropbox_modified_at": new_modified}}
-                            )
-                            files_skipped += 1
-                            continue
-                        
-                        logger.info(f"File changed, will reprocess: {file_metadata['name']}")
-                
-                # Download file from Dropbox
-                file_content = await dropbox_service.download_file(file_metadata["path_display"])
-                
-                # Calculate SHA256 hash
-                sha256_hash = hashlib.sha256(file_content).hexdigest()
-                
-                # Upload to blob storage
-                from ..main import app
-                container_name = os.getenv("BLOB_CONTAINER_NAME", "dropbox")
-                blob_name = f"dropbox/{sha256_hash}/{file_metadata['name']}"
-                blob_client = blob_service.get_blob_client(
-                    container=container_name,
-                    blob=blob_name
-                )
-                
-                await blob_client.upload_blob(
-                    file_content,
-                    overwrite=True
+        async def flush_messages():
+            nonlocal pending_messages, files_queued
+            batch, pending_messages = pending_messages, []
+            if not batch:
+                return
+            
+            sent = await queue_service.send_batch_messages(batch)
+            files_queued += sent
+            
+            # Records of messages that could not be sent are already pending;
+            # mark them failed so the next sync queues them again
+            unsent_ids = [ObjectId(message["file_id"]) for message in batch[sent:]]
+            if unsent_ids:
+                await db.dropbox_files.update_many(
+                    {"_id": {"$in": unsent_ids}},
+                    {"$set": {
+                        "processing_status": "failed",
+                        "processing_metadata.last_error": "Failed to queue file for processing",
+                        "updated_at": datetime.utcnow()
+                    }}
                 )
-                
-                blob_url = blob_client.url
-                logger.info(f"Uploaded to blob storage: {blob_name}")
-                
-                # Create or update file record in MongoDB
-                file_record = {
-                    "dropbox_path": file_metadata["path_display"],
-                    "dropbox_file_id": file_metadata["id"],
-                    "dropbox_rev": file_metadata.get("rev"),
-                    "filename": file_metadata["name"],
-                    "file_type": file_type,
-                    "blob_url": blob_url,
-                    "file_hash": sha256_hash,
-                    "file_size": file_metadata["size"],
-                    "user_id": "system",
-                    "processing_status": "pending",
-                    "chunk_count": 0,
-                    "created_at": datetime.utcnow(),
-                    "updated_at": datetime.utcnow(),
-                    "dropbox_created_at": file_metadata.get("modified"),
-                    "dropbox_modified_at": file_metadata.get("server_modified"),
-                    "metadata": {
-                        "folder": "/".join(file_metadata["path_display"].split("/")[:-1]),
-                        "content_hash": file_hash
-                    }
-                }
-                
-                # Upsert file record
-                result = await db.dropbox_files.update_one(
-                    {"dropbox_file_id": file_metadata["id"]},
-                    {"$set": file_record},
-                    upsert=True
-                )
-                
-                if result.upserted_id:
-                    file_id = str(result.upserted_id)
-                else:
-                    # Get existing ID
-                    existing = await db.dropbox_files.find_one(
-                        {"dropbox_file_id": file_metadata["id"]}
-                    )
-                    file_id = str(existing["_id"])
-                
-                logger.info(f"Created/updated file record: {file_id}")
-                
-                # Send message to queue for processing
-                success = await queue_service.send_dropbox_processing_message(
-                    file_id=file_id,
-                    dropbox_path=file_metadata["path_display"],
-                    dropbox_file_id=file_metadata["id"],
-                    blob_url=blob_url,
-                    filename=file_metadata["name"],
-                    file_type=file_type,
-                    user_id="system"
+        
+        # Files are independent, so sync them concurrently (bounded)
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_SYNC_FILES)
+        
+        async def sync_with_limit(file_metadata: dict):
+            async with semaphore:
+                message = await _sync_file(
+                    file_metadata,
+                    existing_records.get(file_metadata["id"]),
+                    sync_request,
+                    db,
+                    dropbox_service,
+                    queue_service,
+                    blob_container
                 )
-                
-                if success:
-                    files_queued += 1
-                else:
-                    files_skipped += 1
-                    
-            except Exception as e:
-                logger.error(f"Failed to process file {file_metadata['name']}: {e}")
-                files_skipped += 1
-                continue
+            if message:
+                pending_messages.append(message)
+                if len(pending_messages) >= SYNC_QUEUE_BATCH_SIZE:
+                    await flush_messages()
+        
+        await asyncio.gather(*(sync_with_limit(fm) for fm in files))
+        await flush_messages()
+        files_skipped = len(files) - files_queued
         
         return SyncResponse(
             status="success",
@@ -223,8 +357,15 @@ async def get_file_status(
     db = Depends(get_database)
 ):
     """Get processing status of a Dropbox file"""
+    # Reject malformed IDs without constructing an ObjectId or querying MongoDB
+    if not _OBJECT_ID_RE.fullmatch(file_id):
+        raise HTTPException(status_code=400, detail="Invalid file ID")
+    
     try:
-        file = await db.dropbox_files.find_one({"_id": ObjectId(file_id)})
+        file = await db.dropbox_files.find_one(
+            {"_id": ObjectId(file_id)},
+            FILE_RESPONSE_PROJECTION
+        )
         
         if not file:
             raise HTTPException(status_code=404, detail="File not found")
@@ -243,6 +384,8 @@ async def get_file_status(
             updated_at=file["updated_at"]
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to get file status: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -260,7 +403,7 @@ async def list_files(
     List Dropbox files with filtering
     
     Query parameters:
-    - status: Filter by processing status (pending, processing, completed, failed)
+    - status: Filter by processing status (pending, processing, completed, failed, skipped)
     - file_type: Filter by file type (pdf, docx, etc.)
     - page: Page number (1-indexed)
     - page_size: Items per page (max 100)
@@ -277,12 +420,34 @@ async def list_files(
         page_size = min(page_size, 100)
         skip = (page - 1) * page_size
         
-        # Get files
-        cursor = db.dropbox_files.find(filters).sort("updated_at", -1).skip(skip).limit(page_size)
-        files = await cursor.to_list(length=page_size)
-        
-        # Get total count
-        total = await db.dropbox_files.count_documents(filters)
+        if filters:
+            # Get the page and the total count in a single round-trip. The
+            # sort stays outside $facet (whose sub-pipelines cannot use
+            # indexes), so $match + $sort are served by the
+            # (processing_status, _id) index instead of an in-memory sort.
+            pipeline = [
+                {"$match": filters},
+                {"$sort": {"_id": -1}},
+                {"$facet": {
+                    "files": [
+                        {"$skip": skip},
+                        {"$limit": page_size},
+                        {"$project": FILE_RESPONSE_PROJECTION}
+                    ],
+                    "total": [{"$count": "count"}]
+                }}
+            ]
+            cursor = db.dropbox_files.aggregate(pipeline)
+            result = (await cursor.to_list(length=1))[0]
+            files = result["files"]
+            total = result["total"][0]["count"] if result["total"] else 0
+        else:
+            # Get files
+            cursor = db.dropbox_files.find(filters, FILE_RESPONSE_PROJECTION).sort("_id", -1).skip(skip).limit(page_size)
+            files = await cursor.to_list(length=page_size)
+            
+            # Unfiltered total comes from collection metadata, no scan needed
+            total = await db.dropbox_files.estimated_document_count()
         
         # Convert to response models
         file_responses = []
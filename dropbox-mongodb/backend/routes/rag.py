@@ -2,41 +2,218 @@
 RAG (Retrieval-Augmented Generation) routes for vector search
 """
 
+import time
+import asyncio
 import logging
 from typing import List
-from datetime import datetime
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from motor.motor_asyncio import AsyncIOMotorClient
 from bson import ObjectId
 from openai import AsyncAzureOpenAI
 
-from ..models.rag_models import RAGSearchRequest, RAGSearchResponse, RAGSearchResult
+from ..services.embedding_cache import EmbeddingCache
+from ..models.rag_models import (
+    RAGSearchRequest,
+    RAGBatchSearchRequest,
+    RAGSearchResponse,
+    RAGSearchResult
+)
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/api/rag", tags=["rag"])
 
+# Health check responses are cached for this many seconds
+HEALTH_CACHE_SECONDS = 5
+_health_cache: dict = {}
+
 
 # Dependency to get MongoDB database
-async def get_database() -> AsyncIOMotorClient:
+async def get_database(request: Request) -> AsyncIOMotorClient:
     """Get MongoDB database instance"""
-    from ..main import app
-    return app.state.db
+    return request.app.state.db
 
 
 # Dependency to get OpenAI client
-async def get_openai_client() -> AsyncAzureOpenAI:
+async def get_openai_client(request: Request) -> AsyncAzureOpenAI:
     """Get OpenAI client instance"""
-    from ..main import app
-    return app.state.openai_client
+    return request.app.state.openai_client
+
+
+# Dependency to get embedding deployment name
+async def get_embedding_deployment(request: Request) -> str:
+    """Get Azure OpenAI embedding deployment name"""
+    return request.app.state.embedding_deployment
+
+
+# Dependency to get embedding cache
+async def get_embedding_cache(request: Request) -> EmbeddingCache:
+    """Get embedding cache instance"""
+    return request.app.state.embedding_cache
+
+
+def build_search_pipeline(
+    query_embedding: List[float],
+    search_request: RAGSearchRequest
+) -> List[dict]:
+    """
+    Build the vector search aggregation pipeline for one query
+    
+    Args:
+        query_embedding: Embedding vector of the query text
+        search_request: Search parameters (top_k, filters, include_content)
+    
+    Returns:
+        Aggregation pipeline for the dropbox_chunks collection
+    """
+    # Pre-filters are applied inside the ANN traversal, so they must only
+    # reference fields indexed as "filter" in the vectorSearch index
+    vector_filter = {}
+    if search_request.file_types:
+        vector_filter["file_type"] = {"$in": search_request.file_types}
+    if search_request.file_ids:
+        vector_filter["file_id"] = {"$in": [ObjectId(fid) for fid in search_request.file_ids]}
+    
+    # Vector search stage (MongoDB Atlas Vector Search)
+    vector_search_stage = {
+        "$vectorSearch": {
+            "index": "vector_index",  # Ensure this index exists in MongoDB Atlas
+            "path": "embedding",
+            "queryVector": query_embedding,
+            "numCandidates": search_request.top_k * 20,
+            "limit": search_request.top_k
+        }
+    }
+    if vector_filter:
+        vector_search_stage["$vectorSearch"]["filter"] = vector_filter
+    pipeline = [vector_search_stage]
+    
+    # Add score
+    pipeline.append({
+        "$addFields": {
+            "score": {"$meta": "vectorSearchScore"}
+        }
+    })
+    
+    # Join with file metadata
+    pipeline.append({
+        "$lookup": {
+            "from": "dropbox_files",
+            "localField": "file_id",
+            "foreignField": "_id",
+            "as": "file_info"
+        }
+    })
+    
+    # Unwind file info
+    pipeline.append({"$unwind": "$file_info"})
+    
+    # Filter by minimum score if specified
+    if search_request.min_score is not None:
+        pipeline.append({
+            "$match": {
+                "score": {"$gte": search_request.min_score}
+            }
+        })
+    
+    # Project fields
+    projection = {
+        "$project": {
+            "_id": 1,
+            "file_id": 1,
+            "chunk_index": 1,
+            "score": 1,
+            "metadata": 1,
+            "filename": "$file_info.filename",
+            "file_type": "$file_info.file_type",
+            "dropbox_path": "$file_info.dropbox_path"
+        }
+    }
+    
+    # Include content if requested
+    if search_request.include_content:
+        projection["$project"]["content"] = 1
+    
+    pipeline.append(projection)
+    
+    return pipeline
+
+
+async def run_search(
+    db,
+    query_embedding: List[float],
+    search_request: RAGSearchRequest,
+    start_time_ns: int
+) -> RAGSearchResponse:
+    """
+    Run the vector search for one query and build its response
+    
+    Args:
+        db: MongoDB database
+        query_embedding: Embedding vector of the query text
+        search_request: Search parameters
+        start_time_ns: time.perf_counter_ns() when the request started
+    
+    Returns:
+        Search response with ranked results
+    """
+    pipeline = build_search_pipeline(query_embedding, search_request)
+    
+    # Execute search
+    try:
+        cursor = db.dropbox_chunks.aggregate(pipeline)
+        results = await cursor.to_list(length=search_request.top_k)
+    except Exception as e:
+        logger.error(f"Vector search failed: {e}")
+        # Fallback to simple search if vector index doesn't exist
+        logger.warning("Falling back to text search")
+        results = await fallback_text_search(
+            db,
+            search_request.query,
+            search_request.top_k,
+            search_request.file_types,
+            search_request.file_ids,
+            search_request.include_content
+        )
+    
+    # Convert to response models. The pipeline projection fixes the field
+    # shapes, so validation is skipped with model_construct (content is
+    # only projected when include_content is set)
+    search_results = [
+        RAGSearchResult.model_construct(
+            chunk_id=str(result["_id"]),
+            file_id=str(result["file_id"]),
+            filename=result.get("filename", "Unknown"),
+            file_type=result.get("file_type", "unknown"),
+            dropbox_path=result.get("dropbox_path", ""),
+            chunk_index=result["chunk_index"],
+            content=result.get("content"),
+            score=result.get("score", 0.0),
+            metadata=result.get("metadata", {})
+        )
+        for result in results
+    ]
+    
+    search_time = (time.perf_counter_ns() - start_time_ns) / 1e6
+    
+    logger.info(f"RAG search completed: {len(search_results)} results in {search_time:.2f}ms")
+    
+    return RAGSearchResponse(
+        query=search_request.query,
+        results=search_results,
+        total_results=len(search_results),
+        search_time_ms=search_time
+    )
 
 
 @router.post("/search", response_model=RAGSearchResponse)
 async def search(
     search_request: RAGSearchRequest,
     db = Depends(get_database),
-    openai_client: AsyncAzureOpenAI = Depends(get_openai_client)
+    openai_client: AsyncAzureOpenAI = Depends(get_openai_client),
+    embedding_deployment: str = Depends(get_embedding_deployment),
+    embedding_cache: EmbeddingCache = Depends(get_embedding_cache)
 ):
     """
     Search for relevant document chunks using vector similarity
@@ -47,153 +224,78 @@ async def search(
     3. Returns ranked results with source file metadata
     """
     try:
-        start_time = datetime.now()
+        start_time_ns = time.perf_counter_ns()
         
         logger.info(f"RAG search query: {search_request.query[:100]}...")
         
-        # Generate query embedding
+        # Generate query embedding (cached, repeated queries skip the API call)
         try:
-            response = await openai_client.embeddings.create(
-                model=openai_client._custom_query.get("deployment_name", "text-embedding-3-large"),
-                input=[search_request.query]
+            query_embedding = await embedding_cache.get_or_create_embedding(
+                openai_client,
+                embedding_deployment,
+                search_request.query
             )
-            query_embedding = response.data[0].embedding
             logger.info(f"Generated query embedding with {len(query_embedding)} dimensions")
         except Exception as e:
             logger.error(f"Failed to generate query embedding: {e}")
             raise HTTPException(status_code=500, detail="Failed to generate query embedding")
         
-        # Build aggregation pipeline for vector search
-        pipeline = []
-        
-        # Vector search stage (MongoDB Atlas Search)
-        vector_search_stage = {
-            "$search": {
-                "index": "vector_index",  # Ensure this index exists in MongoDB Atlas
-                "knnBeta": {
-                    "vector": query_embedding,
-                    "path": "embedding",
-                    "k": search_request.top_k * 2  # Get more results for filtering
-                }
-            }
-        }
-        pipeline.append(vector_search_stage)
-        
-        # Add score
-        pipeline.append({
-            "$addFields": {
-                "score": {"$meta": "searchScore"}
-            }
-        })
+        return await run_search(db, query_embedding, search_request, start_time_ns)
         
-        # Join with file metadata
-        pipeline.append({
-            "$lookup": {
-                "from": "dropbox_files",
-                "localField": "file_id",
-                "foreignField": "_id",
-                "as": "file_info"
-            }
-        })
-        
-        # Unwind file info
-        pipeline.append({"$unwind": "$file_info"})
-        
-        # Filter by file types if specified
-        if search_request.file_types:
-            pipeline.append({
-                "$match": {
-                    "file_info.file_type": {"$in": search_request.file_types}
-                }
-            })
-        
-        # Filter by file IDs if specified
-        if search_request.file_ids:
-            file_object_ids = [ObjectId(fid) for fid in search_request.file_ids]
-            pipeline.append({
-                "$match": {
-                    "file_info._id": {"$in": file_object_ids}
-                }
-            })
-        
-        # Filter by minimum score if specified
-        if search_request.min_score is not None:
-            pipeline.append({
-                "$match": {
-                    "score": {"$gte": search_request.min_score}
-                }
-            })
-        
-        # Limit results
-        pipeline.append({"$limit": search_request.top_k})
-        
-        # Project fields
-        projection = {
-            "$project": {
-                "_id": 1,
-                "file_id": 1,
-                "chunk_index": 1,
-                "score": 1,
-                "metadata": 1,
-                "filename": "$file_info.filename",
-                "file_type": "$file_info.file_type",
-                "dropbox_path": "$file_info.dropbox_path"
-            }
-        }
-        
-        # Include content if requested
-        if search_request.include_content:
-            projection["$project"]["content"] = 1
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"RAG search failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/search_batch", response_model=List[RAGSearchResponse])
+async def search_batch(
+    batch_request: RAGBatchSearchRequest,
+    db = Depends(get_database),
+    openai_client: AsyncAzureOpenAI = Depends(get_openai_client),
+    embedding_deployment: str = Depends(get_embedding_deployment),
+    embedding_cache: EmbeddingCache = Depends(get_embedding_cache)
+):
+    """
+    Search for several queries in one request
+    
+    All uncached query embeddings are generated with a single embeddings
+    API call, then the vector searches run concurrently. Responses are
+    returned in the same order as the queries.
+    """
+    try:
+        start_time_ns = time.perf_counter_ns()
         
-        pipeline.append(projection)
+        logger.info(f"RAG batch search: {len(batch_request.queries)} queries")
         
-        # Execute search
+        # Generate query embeddings (one API call for all cache misses)
         try:
-            cursor = db.dropbox_chunks.aggregate(pipeline)
-            results = await cursor.to_list(length=search_request.top_k)
-        except Exception as e:
-            logger.error(f"Vector search failed: {e}")
-            # Fallback to simple search if vector index doesn't exist
-            logger.warning("Falling back to text search")
-            results = await fallback_text_search(
-                db,
-                search_request.query,
-                search_request.top_k,
-                search_request.file_types,
-                search_request.file_ids,
-                search_request.include_content
+            query_embeddings = await embedding_cache.get_or_create_embeddings(
+                openai_client,
+                embedding_deployment,
+                batch_request.queries
             )
+        except Exception as e:
+            logger.error(f"Failed to generate query embeddings: {e}")
+            raise HTTPException(status_code=500, detail="Failed to generate query embeddings")
         
-        # Convert to response models
-        search_results = []
-        for result in results:
-            search_results.append(RAGSearchResult(
-                chunk_id=str(result["_id"]),
-                file_id=str(result["file_id"]),
-                filename=result.get("filename", "Unknown"),
-                file_type=result.get("file_type", "unknown"),
-                dropbox_path=result.get("dropbox_path", ""),
-                chunk_index=result["chunk_index"],
-                content=result.get("content") if search_request.include_content else None,
-                score=result.get("score", 0.0),
-                metadata=result.get("metadata", {})
-            ))
-        
-        search_time = (datetime.now() - start_time).total_seconds() * 1000
-        
-        logger.info(f"RAG search completed: {len(search_results)} results in {search_time:.2f}ms")
+        search_options = batch_request.model_dump(exclude={"queries"})
         
-        return RAGSearchResponse(
-            query=search_request.query,
-            results=search_results,
-            total_results=len(search_results),
-            search_time_ms=search_time
-        )
+        return await asyncio.gather(*[
+            run_search(
+                db,
+                query_embedding,
+                RAGSearchRequest(query=query, **search_options),
+                start_time_ns
+            )
+            for query, query_embedding in zip(batch_request.queries, query_embeddings)
+        ])
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"RAG search failed: {e}")
+        logger.error(f"RAG batch search failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -207,88 +309,64 @@ async def fallback_text_search(
 ) -> List[dict]:
     """
     Fallback text search when vector index is not available
-    Uses MongoDB text search on content field
+    Uses the MongoDB text index on the content field, ranked by text score
     """
     try:
-        # Build filter
-        filters = {}
+        # The $text match must be the first stage so it can use the text index
+        pipeline = [
+            {"$match": {"$text": {"$search": query}}},
+            {"$addFields": {"score": {"$meta": "textScore"}}}
+        ]
+        
+        # Filters reference the joined file record
+        match_filters = {}
+        if file_types:
+            match_filters["file_info.file_type"] = {"$in": file_types}
+        if file_ids:
+            file_object_ids = [ObjectId(fid) for fid in file_ids]
+            match_filters["file_info._id"] = {"$in": file_object_ids}
         
-        if file_types or file_ids:
-            # Need to join with files to filter
-            pipeline = []
-            
-            # Join with files
-            pipeline.append({
-                "$lookup": {
-                    "from": "dropbox_files",
-                    "localField": "file_id",
-                    "foreignField": "_id",
-                    "as": "file_info"
-                }
-            })
-            pipeline.append({"$unwind": "$file_info"})
-            
-            # Apply filters
-            match_filters = {}
-            if file_types:
-                match_filters["file_info.file_type"] = {"$in": file_types}
-            if file_ids:
-                file_object_ids = [ObjectId(fid) for fid in file_ids]
-                match_filters["file_info._id"] = {"$in": file_object_ids}
-            
-            if match_filters:
-                pipeline.append({"$match": match_filters})
-            
-            # Text search on content
-            pipeline.append({
-                "$match": {
-                    "content": {"$regex": query, "$options": "i"}
-                }
-            })
-            
-            # Project fields
-            projection = {
-                "_id": 1,
-                "file_id": 1,
-                "chunk_index": 1,
-                "metadata": 1,
-                "filename": "$file_info.filename",
-                "file_type": "$file_info.file_type",
-                "dropbox_path": "$file_info.dropbox_path",
-                "score": {"$literal": 0.5}  # Default score for text search
+        # Without filters, rank and limit before the join so only top_k
+        # chunks are looked up
+        ranking = [{"$sort": {"score": -1}}, {"$limit": top_k}]
+        if not match_filters:
+            pipeline.extend(ranking)
+        
+        # Join with files (one aggregation instead of a lookup per chunk)
+        pipeline.append({
+            "$lookup": {
+                "from": "dropbox_files",
+                "localField": "file_id",
+                "foreignField": "_id",
+                "as": "file_info"
             }
-            if include_content:
-                projection["content"] = 1
-            
-            pipeline.append({"$project": projection})
-            pipeline.append({"$limit": top_k})
-            
-            cursor = db.dropbox_chunks.aggregate(pipeline)
-            results = await cursor.to_list(length=top_k)
-        else:
-            # Simple text search without filters
-            filters["content"] = {"$regex": query, "$options": "i"}
-            
-            cursor = db.dropbox_chunks.find(filters).limit(top_k)
-            chunks = await cursor.to_list(length=top_k)
-            
-            # Fetch file info for each chunk
-            results = []
-            for chunk in chunks:
-                file = await db.dropbox_files.find_one({"_id": chunk["file_id"]})
-                result = {
-                    "_id": chunk["_id"],
-                    "file_id": chunk["file_id"],
-                    "chunk_index": chunk["chunk_index"],
-                    "metadata": chunk.get("metadata", {}),
-                    "filename": file.get("filename", "Unknown") if file else "Unknown",
-                    "file_type": file.get("file_type", "unknown") if file else "unknown",
-                    "dropbox_path": file.get("dropbox_path", "") if file else "",
-                    "score": 0.5
-                }
-                if include_content:
-                    result["content"] = chunk.get("content", "")
-                results.append(result)
+        })
+        pipeline.append({
+            "$unwind": {"path": "$file_info", "preserveNullAndEmptyArrays": True}
+        })
+        
+        if match_filters:
+            pipeline.append({"$match": match_filters})
+            pipeline.extend(ranking)
+        
+        # Project fields
+        projection = {
+            "_id": 1,
+            "file_id": 1,
+            "chunk_index": 1,
+            "metadata": 1,
+            "filename": {"$ifNull": ["$file_info.filename", "Unknown"]},
+            "file_type": {"$ifNull": ["$file_info.file_type", "unknown"]},
+            "dropbox_path": {"$ifNull": ["$file_info.dropbox_path", ""]},
+            "score": 1
+        }
+        if include_content:
+            projection["content"] = 1
+        
+        pipeline.append({"$project": projection})
+        
+        cursor = db.dropbox_chunks.aggregate(pipeline)
+        results = await cursor.to_list(length=top_k)
         
         return results
         
@@ -300,16 +378,23 @@ async def fallback_text_search(
 @router.get("/health")
 async def health_check(db = Depends(get_database)):
     """Health check endpoint for RAG service"""
+    # Serve repeated probes within the same 5s window from cache
+    window = int(time.monotonic()) // HEALTH_CACHE_SECONDS
+    if _health_cache.get("window") == window:
+        return _health_cache["response"]
+    
     try:
-        # Check MongoDB connection
-        await db.command("ping")
-        
-        # Get stats
-        file_count = await db.dropbox_files.count_documents({})
-        chunk_count = await db.dropbox_chunks.count_documents({})
-        completed_count = await db.dropbox_files.count_documents({"processing_status": "completed"})
+        # Get stats (totals come from collection metadata, the completed
+        # count is served by the processing_status index). The queries run
+        # concurrently and succeeding proves the connection, so no
+        # separate ping is needed.
+        file_count, chunk_count, completed_count = await asyncio.gather(
+            db.dropbox_files.estimated_document_count(),
+            db.dropbox_chunks.estimated_document_count(),
+            db.dropbox_files.count_documents({"processing_status": "completed"})
+        )
         
-        return {
+        response = {
             "status": "healthy",
             "database": "connected",
             "stats": {
@@ -318,7 +403,9 @@ async def health_check(db = Depends(get_database)):
                 "total_chunks": chunk_count
             }
         }
+        _health_cache["window"] = window
+        _health_cache["response"] = response
+        return response
     except Exception as e:
         logger.error(f"Health check failed: {e}")
         raise HTTPException(status_code=503, detail="Service unhealthy")
-
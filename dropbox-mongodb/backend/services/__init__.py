@@ -2,9 +2,11 @@
 
 from .dropbox_service import DropboxService
 from .queue_service import QueueService
+from .embedding_cache import EmbeddingCache
 
 __all__ = [
     "DropboxService",
-    "QueueService"
+    "QueueService",
+    "EmbeddingCache"
 ]
 
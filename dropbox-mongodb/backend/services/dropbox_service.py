@@ -2,8 +2,9 @@
 Service for interacting with Dropbox API
 """
 
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, AsyncIterator
 import hashlib
 import hmac
 
@@ -13,9 +14,23 @@ from dropbox.exceptions import ApiError
 
 logger = logging.getLogger(__name__)
 
+# File types supported for processing. Only formats the worker's docling
+# converter accepts are synced (not the legacy doc/ppt/xls, rtf or txt),
+# since any other file would only be skipped by the worker.
+SUPPORTED_FILE_TYPES = frozenset({
+    'pdf', 'docx', 'pptx',
+    'md', 'html', 'htm',
+    'xlsx', 'csv'
+})
+
 
 class DropboxService:
-    """Service for interacting with Dropbox API"""
+    """
+    Service for interacting with Dropbox API
+    
+    The Dropbox SDK is synchronous, so every SDK call runs in a worker
+    thread to keep the event loop free for other requests.
+    """
     
     def __init__(self, access_token: str, app_key: Optional[str] = None, app_secret: Optional[str] = None):
         """
@@ -29,11 +44,43 @@ class DropboxService:
         self.access_token = access_token
         self.app_key = app_key
         self.app_secret = app_secret
+        self._app_secret_bytes = app_secret.encode() if app_secret else None
         self.dbx = dropbox.Dropbox(access_token)
         
-    async def download_file(self, dropbox_path: str) -> bytes:
+    async def download_file(self, dropbox_path: str, *, chunk_size: int = 1 << 20) -> AsyncIterator[bytes]:
         """
-        Download file content from Dropbox
+        Download file content from Dropbox as a stream of chunks
+        
+        Peak memory is one chunk rather than the whole file; use
+        download_file_bytes() when the full content is really needed.
+        
+        Args:
+            dropbox_path: Full path in Dropbox
+            chunk_size: Size of each yielded chunk in bytes
+            
+        Yields:
+            File content chunks as bytes
+        """
+        try:
+            metadata, response = await asyncio.to_thread(self.dbx.files_download, dropbox_path)
+        except ApiError as e:
+            logger.error(f"Failed to download {dropbox_path}: {e}")
+            raise
+        
+        try:
+            # The SDK response is a blocking HTTP stream, so each read runs in a thread
+            chunks = response.iter_content(chunk_size)
+            while True:
+                chunk = await asyncio.to_thread(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            response.close()
+    
+    async def download_file_bytes(self, dropbox_path: str) -> bytes:
+        """
+        Download the full file content from Dropbox
         
         Args:
             dropbox_path: Full path in Dropbox
@@ -42,11 +89,15 @@ class DropboxService:
             File content as bytes
         """
         try:
-            metadata, response = self.dbx.files_download(dropbox_path)
-            return response.content
+            metadata, response = await asyncio.to_thread(self.dbx.files_download, dropbox_path)
         except ApiError as e:
             logger.error(f"Failed to download {dropbox_path}: {e}")
             raise
+        
+        try:
+            return response.content
+        finally:
+            response.close()
     
     async def get_file_metadata(self, dropbox_path: str) -> Dict[str, Any]:
         """
@@ -56,7 +107,7 @@ class DropboxService:
             Dictionary with file metadata
         """
         try:
-            metadata = self.dbx.files_get_metadata(dropbox_path)
+            metadata = await asyncio.to_thread(self.dbx.files_get_metadata, dropbox_path)
             
             if isinstance(metadata, FileMetadata):
                 return {
@@ -93,20 +144,30 @@ class DropboxService:
             List of file metadata dictionaries
         """
         files = []
+        file_types_set = frozenset(t.lower() for t in file_types) if file_types else None
+        next_page = None
         
         try:
-            result = self.dbx.files_list_folder(
+            result = await asyncio.to_thread(
+                self.dbx.files_list_folder,
                 folder_path,
                 recursive=recursive
             )
             
             while True:
+                # Prefetch the next page while this one is filtered
+                if result.has_more:
+                    next_page = asyncio.create_task(asyncio.to_thread(
+                        self.dbx.files_list_folder_continue,
+                        result.cursor
+                    ))
+                
                 for entry in result.entries:
                     if isinstance(entry, FileMetadata):
                         # Filter by file type if specified
-                        if file_types:
-                            file_ext = entry.name.split('.')[-1].lower() if '.' in entry.name else ''
-                            if file_ext not in file_types:
+                        if file_types_set:
+                            file_ext = self.get_file_extension(entry.name)
+                            if file_ext not in file_types_set:
                                 continue
                         
                         files.append({
@@ -120,10 +181,11 @@ class DropboxService:
                             "content_hash": entry.content_hash
                         })
                 
-                if not result.has_more:
+                if not next_page:
                     break
-                    
-                result = self.dbx.files_list_folder_continue(result.cursor)
+                
+                result = await next_page
+                next_page = None
             
             logger.info(f"Listed {len(files)} files from {folder_path or 'root'}")
             return files
@@ -131,6 +193,10 @@ class DropboxService:
         except ApiError as e:
             logger.error(f"Failed to list files in {folder_path}: {e}")
             raise
+        finally:
+            # Don't leave a prefetch running if filtering raised
+            if next_page:
+                next_page.cancel()
     
     def verify_webhook_signature(
         self,
@@ -151,23 +217,30 @@ class DropboxService:
             logger.warning("App secret not configured, cannot verify webhook signature")
             return False
         
+        # Compare raw digests rather than hex strings
+        try:
+            signature_bytes = bytes.fromhex(signature)
+        except ValueError:
+            return False
+        
         expected_signature = hmac.new(
-            self.app_secret.encode(),
+            self._app_secret_bytes,
             body,
             hashlib.sha256
-        ).hexdigest()
+        ).digest()
         
-        return hmac.compare_digest(signature, expected_signature)
+        return hmac.compare_digest(signature_bytes, expected_signature)
     
     async def get_shared_link(self, dropbox_path: str) -> Optional[str]:
         """Get or create a shared link for a file"""
         try:
-            links = self.dbx.sharing_list_shared_links(path=dropbox_path)
+            links = await asyncio.to_thread(self.dbx.sharing_list_shared_links, path=dropbox_path)
             if links.links:
                 return links.links[0].url
             
             # Create new shared link
-            link = self.dbx.sharing_create_shared_link_with_settings(
+            link = await asyncio.to_thread(
+                self.dbx.sharing_create_shared_link_with_settings,
                 dropbox_path
             )
             return link.url
@@ -177,16 +250,10 @@ class DropboxService:
     
     def get_file_extension(self, filename: str) -> str:
         """Extract file extension from filename"""
-        if '.' in filename:
-            return filename.split('.')[-1].lower()
-        return ''
+        _, dot, extension = filename.rpartition('.')
+        return extension.lower() if dot else ''
     
     def is_supported_file_type(self, file_type: str) -> bool:
         """Check if file type is supported for processing"""
-        supported_types = [
-            'pdf', 'docx', 'doc', 'pptx', 'ppt',
-            'txt', 'md', 'html', 'htm', 'rtf',
-            'xlsx', 'xls', 'csv'
-        ]
-        return file_type.lower() in supported_types
+        return file_type.lower() in SUPPORTED_FILE_TYPES
 
@@ -0,0 +1,192 @@
+"""
+Two-level cache for query embeddings
+"""
+
+import hashlib
+import logging
+from array import array
+from collections import OrderedDict
+from typing import List, Optional
+
+from openai import AsyncAzureOpenAI
+
+# Redis is optional - without it only the in-process cache is used
+try:
+    from redis.asyncio import Redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    Redis = None
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """Cache embeddings in an in-process LRU (L1) backed by Redis (L2)"""
+    
+    def __init__(
+        self,
+        redis_client: Optional["Redis"] = None,
+        max_size: int = 1024,
+        ttl_seconds: int = 7 * 24 * 3600
+    ):
+        """
+        Initialize embedding cache
+        
+        Args:
+            redis_client: Async Redis client for the shared L2 cache (optional)
+            max_size: Maximum number of embeddings kept in the L1 cache
+            ttl_seconds: Expiry for embeddings stored in Redis
+        """
+        self.redis = redis_client
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        # Embeddings are kept as packed float32 arrays, a quarter of the
+        # memory of a list of Python floats
+        self._lru: "OrderedDict[str, array]" = OrderedDict()
+    
+    @staticmethod
+    def cache_key(model: str, text: str) -> str:
+        """Build the cache key for an embedding of text with model"""
+        digest = hashlib.sha256(f"{model}|{text}".encode("utf-8")).hexdigest()
+        return f"embedding:{digest}"
+    
+    def _remember(self, key: str, vector: array):
+        """Insert into the L1 cache, evicting the least recently used entry"""
+        self._lru[key] = vector
+        self._lru.move_to_end(key)
+        if len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+    
+    async def get_or_create_embedding(
+        self,
+        openai_client: AsyncAzureOpenAI,
+        model: str,
+        text: str
+    ) -> List[float]:
+        """
+        Get the embedding for text, generating it only on a cache miss
+        
+        Args:
+            openai_client: Azure OpenAI client used on a cache miss
+            model: Embedding deployment name
+            text: Text to embed
+        
+        Returns:
+            Embedding vector
+        """
+        key = self.cache_key(model, text)
+        
+        # L1: in-process LRU
+        vector = self._lru.get(key)
+        if vector is not None:
+            self._lru.move_to_end(key)
+            return vector.tolist()
+        
+        # L2: Redis, stored as float32 bytes
+        if self.redis:
+            try:
+                packed = await self.redis.get(key)
+                if packed:
+                    vector = array("f", packed)
+                    self._remember(key, vector)
+                    return vector.tolist()
+            except Exception as e:
+                logger.warning(f"Embedding cache lookup failed: {e}")
+        
+        # Miss: generate embedding
+        response = await openai_client.embeddings.create(
+            model=model,
+            input=[text]
+        )
+        embedding = response.data[0].embedding
+        vector = array("f", embedding)
+        self._remember(key, vector)
+        
+        if self.redis:
+            try:
+                await self.redis.setex(key, self.ttl_seconds, vector.tobytes())
+            except Exception as e:
+                logger.warning(f"Embedding cache store failed: {e}")
+        
+        return embedding
+    
+    async def get_or_create_embeddings(
+        self,
+        openai_client: AsyncAzureOpenAI,
+        model: str,
+        texts: List[str]
+    ) -> List[List[float]]:
+        """
+        Get embeddings for several texts with at most one API call
+        
+        Args:
+            openai_client: Azure OpenAI client used for cache misses
+            model: Embedding deployment name
+            texts: Texts to embed
+        
+        Returns:
+            Embedding vectors in the same order as texts
+        """
+        keys = [self.cache_key(model, text) for text in texts]
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        
+        # L1: in-process LRU
+        for i, key in enumerate(keys):
+            vector = self._lru.get(key)
+            if vector is not None:
+                self._lru.move_to_end(key)
+                embeddings[i] = vector.tolist()
+        
+        # L2: Redis, one MGET for every L1 miss
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing and self.redis:
+            try:
+                packed_values = await self.redis.mget([keys[i] for i in missing])
+                for i, packed in zip(missing, packed_values):
+                    if packed:
+                        vector = array("f", packed)
+                        self._remember(keys[i], vector)
+                        embeddings[i] = vector.tolist()
+            except Exception as e:
+                logger.warning(f"Embedding cache lookup failed: {e}")
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        if not missing:
+            return embeddings
+        
+        # Misses: generate all remaining embeddings in one request
+        # (duplicate texts are only sent once)
+        unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+        response = await openai_client.embeddings.create(
+            model=model,
+            input=unique_texts
+        )
+        generated = {
+            text: item.embedding
+            for text, item in zip(unique_texts, sorted(response.data, key=lambda d: d.index))
+        }
+        
+        to_store = {}
+        for i in missing:
+            embeddings[i] = generated[texts[i]]
+            vector = array("f", embeddings[i])
+            self._remember(keys[i], vector)
+            to_store[keys[i]] = vector.tobytes()
+        
+        if self.redis:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key, packed in to_store.items():
+                        pipe.setex(key, self.ttl_seconds, packed)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning(f"Embedding cache store failed: {e}")
+        
+        return embeddings
+    
+    async def close(self):
+        """Close the Redis connection pool"""
+        if self.redis:
+            await self.redis.aclose()
+            self.redis = None
@@ -2,11 +2,12 @@
 Service for Azure Service Bus queue operations
 """
 
+import asyncio
 import logging
-import json
 from typing import Dict, Any, Optional
 from datetime import datetime
 
+import orjson
 from azure.servicebus.aio import ServiceBusClient
 from azure.servicebus import ServiceBusMessage
 
@@ -27,20 +28,78 @@ class QueueService:
         self.connection_string = connection_string
         self.queue_name = queue_name
         self.sb_client = None
+        self.sender = None
+        self._connect_lock = asyncio.Lock()
     
     async def connect(self):
-        """Initialize Service Bus client"""
-        if not self.sb_client:
-            self.sb_client = ServiceBusClient.from_connection_string(
-                self.connection_string
-            )
+        """Initialize Service Bus client and a long-lived queue sender"""
+        if self.sender:
+            return
+        
+        async with self._connect_lock:
+            if self.sender:
+                return
+            
+            if not self.sb_client:
+                self.sb_client = ServiceBusClient.from_connection_string(
+                    self.connection_string
+                )
+            
+            # Open the AMQP link once and reuse it for every send
+            sender = self.sb_client.get_queue_sender(queue_name=self.queue_name)
+            await sender.__aenter__()
+            self.sender = sender
             logger.info(f"Connected to Service Bus queue: {self.queue_name}")
     
     async def disconnect(self):
-        """Close Service Bus client"""
-        if self.sb_client:
-            await self.sb_client.close()
-            self.sb_client = None
+        """Close the queue sender and Service Bus client"""
+        async with self._connect_lock:
+            if self.sender:
+                await self.sender.__aexit__(None, None, None)
+                self.sender = None
+            if self.sb_client:
+                await self.sb_client.close()
+                self.sb_client = None
+    
+    def build_dropbox_processing_message(
+        self,
+        file_id: str,
+        dropbox_path: str,
+        dropbox_file_id: str,
+        blob_url: str,
+        filename: str,
+        file_type: str,
+        user_id: str = "system",
+        additional_metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        Build the body of a dropbox-file-processing queue message
+        
+        Args:
+            file_id: MongoDB ObjectId of the file record
+            dropbox_path: Full path in Dropbox
+            dropbox_file_id: Dropbox unique file ID
+            blob_url: Azure Blob Storage URL
+            filename: Original filename
+            file_type: File extension
+            user_id: User who triggered the processing
+            additional_metadata: Optional metadata dictionary
+            
+        Returns:
+            Message body dictionary
+        """
+        return {
+            "message_type": "dropbox_file",
+            "file_id": file_id,
+            "dropbox_path": dropbox_path,
+            "dropbox_file_id": dropbox_file_id,
+            "blob_url": blob_url,
+            "filename": filename,
+            "file_type": file_type,
+            "user_id": user_id,
+            "metadata": additional_metadata or {},
+            "timestamp": datetime.utcnow().isoformat()
+        }
     
     async def send_dropbox_processing_message(
         self,
@@ -73,29 +132,24 @@ class QueueService:
             # Ensure client is connected
             await self.connect()
             
-            message_body = {
-                "message_type": "dropbox_file",
-                "file_id": file_id,
-                "dropbox_path": dropbox_path,
-                "dropbox_file_id": dropbox_file_id,
-                "blob_url": blob_url,
-                "filename": filename,
-                "file_type": file_type,
-                "user_id": user_id,
-                "metadata": additional_metadata or {},
-                "timestamp": datetime.utcnow().isoformat()
-            }
+            message_body = self.build_dropbox_processing_message(
+                file_id=file_id,
+                dropbox_path=dropbox_path,
+                dropbox_file_id=dropbox_file_id,
+                blob_url=blob_url,
+                filename=filename,
+                file_type=file_type,
+                user_id=user_id,
+                additional_metadata=additional_metadata
+            )
             
             message = ServiceBusMessage(
-                body=json.dumps(message_body),
+                body=orjson.dumps(message_body),
                 content_type="application/json"
             )
             
             # Send to queue
-            async with self.sb_client.get_queue_sender(
-                queue_name=self.queue_name
-            ) as sender:
-                await sender.send_messages(message)
+            await self.sender.send_messages(message)
             
             logger.info(f"Sent processing message for file {file_id}: {filename}")
             return True
@@ -109,34 +163,43 @@ class QueueService:
         messages: list[Dict[str, Any]]
     ) -> int:
         """
-        Send multiple messages in batch
+        Send multiple messages in as few size-bounded batches as possible
+        
+        Batches are sent in order and stop at the first failure, so the
+        messages sent are always a prefix of messages.
         
         Args:
             messages: List of message dictionaries
             
         Returns:
-            Number of messages sent successfully
+            Number of messages sent successfully (messages[:n] were sent)
         """
+        sent = 0
         try:
             await self.connect()
             
-            sb_messages = []
+            batch = await self.sender.create_message_batch()
             for msg_body in messages:
                 message = ServiceBusMessage(
-                    body=json.dumps(msg_body),
+                    body=orjson.dumps(msg_body),
                     content_type="application/json"
                 )
-                sb_messages.append(message)
+                try:
+                    batch.add_message(message)
+                except ValueError:
+                    # Batch is full (size limit), send it and start a new one
+                    await self.sender.send_messages(batch)
+                    sent += len(batch)
+                    batch = await self.sender.create_message_batch()
+                    batch.add_message(message)
             
-            async with self.sb_client.get_queue_sender(
-                queue_name=self.queue_name
-            ) as sender:
-                await sender.send_messages(sb_messages)
+            if len(batch):
+                await self.sender.send_messages(batch)
+                sent += len(batch)
             
-            logger.info(f"Sent batch of {len(sb_messages)} messages")
-            return len(sb_messages)
+            logger.info(f"Sent {sent} messages in batches")
             
         except Exception as e:
-            logger.error(f"Failed to send batch messages: {e}")
-            return 0
-
+            logger.error(f"Failed to send batch messages ({sent} of {len(messages)} sent): {e}")
+        
+        return sent
@@ -1,19 +1,22 @@
 #!/usr/bin/env python3
 """Check if markdown file exists in blob storage"""
 
-import os
 import sys
-from pathlib import Path
-from dotenv import load_dotenv
-from azure.storage.blob import BlobServiceClient
+import zlib
+
+from _env import load_env
 
-# Load environment variables
-env_path = Path(__file__).parent / "worker" / ".env"
-if env_path.exists():
-    load_dotenv(env_path)
+env = load_env()
+BLOB_CONNECTION_STRING = env.BLOB_CONNECTION_STRING
+BLOB_CONTAINER_NAME = env.BLOB_CONTAINER_NAME
 
-BLOB_CONNECTION_STRING = os.getenv("BLOB_CONNECTION_STRING")
-BLOB_CONTAINER_NAME = os.getenv("BLOB_CONTAINER_NAME", "dropbox")
+if not BLOB_CONNECTION_STRING:
+    print("Error: BLOB_CONNECTION_STRING not found")
+    exit(1)
+
+# Imported after the check above so a missing setting exits immediately
+from azure.core.exceptions import ResourceNotFoundError
+from azure.storage.blob import BlobServiceClient
 
 file_id = sys.argv[1] if len(sys.argv) > 1 else "691c9ae12f50138591eef60f"
 
@@ -26,15 +29,30 @@ blob_client = container_client.get_blob_client(markdown_blob_name)
 
 print(f"Checking for markdown blob: {markdown_blob_name}")
 
-if blob_client.exists():
-    props = blob_client.get_blob_properties()
+# A single ranged download both checks existence and fetches the preview.
+# 500 characters of UTF-8 are at most 2000 bytes (and compressed markdown
+# is smaller still).
+try:
+    downloader = blob_client.download_blob(offset=0, length=2048)
+except ResourceNotFoundError:
+    downloader = None
+
+if downloader is not None:
+    props = downloader.properties
+    # For a ranged download props.size is the range length; the full blob
+    # size is the total in Content-Range ("bytes 0-2047/<total>")
+    blob_size = int(props.content_range.rpartition("/")[2]) if props.content_range else props.size
     print(f"✓ Markdown file exists!")
-    print(f"  Size: {props.size:,} bytes")
+    print(f"  Size: {blob_size:,} bytes")
     print(f"  Last Modified: {props.last_modified}")
     
     # Try to read first 500 chars
     try:
-        content = blob_client.download_blob().readall().decode('utf-8')
+        content = downloader.readall()
+        if props.content_settings.content_encoding == "gzip":
+            # Decompress as much of the gzip stream as the range covers
+            content = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(content)
+        content = content.decode('utf-8', errors='replace')
         print(f"\nFirst 500 characters:")
         print(content[:500])
     except Exception as e:
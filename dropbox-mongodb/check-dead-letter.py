@@ -1,24 +1,58 @@
 #!/usr/bin/env python3
 """Check dead letter messages in Service Bus queue"""
 
-import os
 import json
-from pathlib import Path
-from dotenv import load_dotenv
-from azure.servicebus import ServiceBusClient, ServiceBusReceiveMode
+import argparse
+
+from _env import load_env
 
-# Load environment variables
-env_path = Path(__file__).parent / "worker" / ".env"
-if env_path.exists():
-    load_dotenv(env_path)
+parser = argparse.ArgumentParser(description="Check dead letter messages in Service Bus queue")
+parser.add_argument("-c", "--count", type=int, default=100,
+                    help="Maximum number of messages to receive in one batch (default: 100)")
+args = parser.parse_args()
 
-SERVICE_BUS_CONNECTION_STRING = os.getenv("SERVICE_BUS_CONNECTION_STRING")
-SERVICE_BUS_QUEUE_NAME = os.getenv("SERVICE_BUS_QUEUE_NAME", "dropbox-file-processing")
+env = load_env()
+SERVICE_BUS_CONNECTION_STRING = env.SERVICE_BUS_CONNECTION_STRING
+SERVICE_BUS_QUEUE_NAME = env.SERVICE_BUS_QUEUE_NAME
 
 if not SERVICE_BUS_CONNECTION_STRING:
     print("Error: SERVICE_BUS_CONNECTION_STRING not found")
     exit(1)
 
+# Imported after the check above so a missing setting exits immediately
+from azure.servicebus import ServiceBusClient, ServiceBusReceiveMode
+
+
+def format_message(msg):
+    """Format a dead letter message for printing"""
+    lines = [
+        "=" * 60,
+        "DEAD LETTER MESSAGE",
+        "=" * 60
+    ]
+    
+    # Get message body
+    body = msg.body
+    if isinstance(body, bytes):
+        body = body.decode('utf-8')
+    
+    try:
+        message_data = json.loads(body)
+        lines.append("\nMessage Body:")
+        lines.append(json.dumps(message_data, indent=2))
+    except:
+        lines.append(f"\nMessage Body (raw): {body}")
+    
+    # Get message properties
+    lines.append(f"\nMessage Properties:")
+    lines.append(f"  Message ID: {msg.message_id}")
+    lines.append(f"  Delivery Count: {msg.delivery_count}")
+    lines.append(f"  Enqueued Time: {msg.enqueued_time_utc}")
+    lines.append(f"  Dead Letter Reason: {msg.dead_letter_reason}")
+    lines.append(f"  Dead Letter Error Description: {msg.dead_letter_error_description}")
+    return "\n".join(lines)
+
+
 servicebus_client = ServiceBusClient.from_connection_string(SERVICE_BUS_CONNECTION_STRING)
 
 with servicebus_client:
@@ -29,40 +63,21 @@ with servicebus_client:
         receiver = servicebus_client.get_queue_receiver(
             queue_name=dead_letter_queue_name,
             receive_mode=ServiceBusReceiveMode.PEEK_LOCK,
-            max_wait_time=5
+            max_wait_time=5,
+            prefetch_count=args.count
         )
         
         with receiver:
-            messages = receiver.receive_messages(max_message_count=1, max_wait_time=5)
+            # Receive up to --count messages in one round trip
+            messages = receiver.receive_messages(max_message_count=args.count, max_wait_time=5)
             
             if messages:
-                msg = messages[0]
-                print("=" * 60)
-                print("DEAD LETTER MESSAGE")
-                print("=" * 60)
-                
-                # Get message body
-                body = msg.body
-                if isinstance(body, bytes):
-                    body = body.decode('utf-8')
-                
-                try:
-                    message_data = json.loads(body)
-                    print("\nMessage Body:")
-                    print(json.dumps(message_data, indent=2))
-                except:
-                    print(f"\nMessage Body (raw): {body}")
-                
-                # Get message properties
-                print(f"\nMessage Properties:")
-                print(f"  Message ID: {msg.message_id}")
-                print(f"  Delivery Count: {msg.delivery_count}")
-                print(f"  Enqueued Time: {msg.enqueued_time_utc}")
-                print(f"  Dead Letter Reason: {msg.dead_letter_reason}")
-                print(f"  Dead Letter Error Description: {msg.dead_letter_error_description}")
+                print("\n\n".join(format_message(msg) for msg in messages))
+                print(f"\nFound {len(messages)} dead letter message(s)")
                 
                 # Don't complete/delete - just peek
-                receiver.abandon_message(msg)
+                for msg in messages:
+                    receiver.abandon_message(msg)
                 
             else:
                 print("No dead letter messages found")
@@ -1,25 +1,18 @@
 #!/usr/bin/env python3
 """Check for processing errors in MongoDB"""
 
-import os
-from pathlib import Path
-from dotenv import load_dotenv
-from pymongo import MongoClient
-from bson import ObjectId
+from _clients import get_database, oid
 
-# Load environment variables
-env_path = Path(__file__).parent / "worker" / ".env"
-if env_path.exists():
-    load_dotenv(env_path)
+db = get_database()
 
-MONGODB_URI = os.getenv("MONGODB_URI")
-MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "isaac-dropbox")
-
-client = MongoClient(MONGODB_URI)
-db = client[MONGODB_DATABASE]
+# Only fetch the fields that are printed. The processing_status queries use
+# the (processing_status, _id) index the backend creates on startup.
 
 # Check for failed files
-failed_files = list(db.dropbox_files.find({"processing_status": "failed"}).limit(10))
+failed_files = list(db.dropbox_files.find(
+    {"processing_status": "failed"},
+    {"filename": 1, "processing_metadata.last_error": 1, "processing_metadata.attempts": 1}
+).limit(10))
 
 if failed_files:
     print("=" * 60)
@@ -36,7 +29,10 @@ else:
     print("No failed files found")
 
 # Check for files stuck in processing
-processing_files = list(db.dropbox_files.find({"processing_status": "processing"}).limit(10))
+processing_files = list(db.dropbox_files.find(
+    {"processing_status": "processing"},
+    {"filename": 1, "updated_at": 1}
+).limit(10))
 
 if processing_files:
     print("\n" + "=" * 60)
@@ -51,7 +47,10 @@ else:
 
 # Check the specific file
 file_id = "691c7c5e189bc4bbcb072913"
-file_record = db.dropbox_files.find_one({"_id": ObjectId(file_id)})
+file_record = db.dropbox_files.find_one(
+    {"_id": oid(file_id)},
+    {"processing_status": 1, "processing_metadata": 1}
+)
 
 if file_record:
     print("\n" + "=" * 60)
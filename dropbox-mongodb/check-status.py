@@ -1,38 +1,118 @@
 #!/usr/bin/env python3
-"""Check the processing status of a file"""
+"""Check the processing status of one or more files"""
 
-import os
 import sys
-from pathlib import Path
-from dotenv import load_dotenv
-from pymongo import MongoClient
-from bson import ObjectId
-from azure.storage.blob import BlobServiceClient
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
 
-# Load environment variables
-env_path = Path(__file__).parent / "worker" / ".env"
-if env_path.exists():
-    load_dotenv(env_path)
+from _clients import get_database, get_blob_service_client, oid
+from _env import load_env
 
-MONGODB_URI = os.getenv("MONGODB_URI")
-MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "isaac-dropbox")
-BLOB_CONNECTION_STRING = os.getenv("BLOB_CONNECTION_STRING")
-BLOB_CONTAINER_NAME = os.getenv("BLOB_CONTAINER_NAME", "dropbox")
+env = load_env()
+BLOB_CONNECTION_STRING = env.BLOB_CONNECTION_STRING
+BLOB_CONTAINER_NAME = env.BLOB_CONTAINER_NAME
 
-def check_file_status(file_id: str):
-    """Check the status of a file in MongoDB"""
-    client = MongoClient(MONGODB_URI)
-    db = client[MONGODB_DATABASE]
+def get_markdown_blob_properties(container_client, file_id: str):
+    """Get the properties of a file's markdown blob, or None if it does not exist"""
+    from azure.core.exceptions import ResourceNotFoundError
+    
+    # Blob path is markdown/{file_id}.md within the dropbox container
+    blob_client = container_client.get_blob_client(f"markdown/{file_id}.md")
     
+    # One HEAD request both checks existence and returns properties
     try:
-        file_obj_id = ObjectId(file_id)
-    except:
-        print(f"Error: Invalid file ID format: {file_id}")
-        return
+        return blob_client.get_blob_properties()
+    except ResourceNotFoundError:
+        return None
+
+def count_chunks(db, file_ids: list) -> dict:
+    """Count the chunks of each file, keyed by file ID string"""
+    pipeline = [
+        {"$match": {"file_id": {"$in": file_ids}}},
+        {"$group": {"_id": "$file_id", "n": {"$sum": 1}}}
+    ]
+    return {str(group["_id"]): group["n"] for group in db.dropbox_chunks.aggregate(pipeline)}
+
+def check_files_status(file_ids: List[str]):
+    """Check the status of several files in MongoDB and Blob Storage"""
+    db = get_database()
     
-    # Get file record
-    file_record = db.dropbox_files.find_one({"_id": file_obj_id})
+    valid_ids = []
+    for file_id in file_ids:
+        try:
+            valid_ids.append(oid(file_id))
+        except:
+            print(f"Error: Invalid file ID format: {file_id}")
+    if not valid_ids:
+        return
     
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        # Blob HEAD requests run in parallel with each other and with the
+        # MongoDB query below
+        blob_checks = {}
+        if BLOB_CONNECTION_STRING:
+            container_client = get_blob_service_client().get_container_client(BLOB_CONTAINER_NAME)
+            blob_checks = {
+                str(file_oid): executor.submit(get_markdown_blob_properties, container_client, str(file_oid))
+                for file_oid in valid_ids
+            }
+        
+        # Get the file records and a sample chunk each in one round trip,
+        # projecting only the fields printed below
+        pipeline = [
+            {"$match": {"_id": {"$in": valid_ids}}},
+            {"$project": {
+                "filename": 1,
+                "dropbox_path": 1,
+                "file_type": 1,
+                "file_size": 1,
+                "processing_status": 1,
+                "chunk_count": 1,
+                "markdown_blob_url": 1,
+                "processing_metadata.last_error": 1,
+                "processing_metadata.attempts": 1,
+                "processing_metadata.processing_time": 1,
+                "created_at": 1,
+                "updated_at": 1
+            }},
+            {"$lookup": {
+                "from": "dropbox_chunks",
+                "localField": "_id",
+                "foreignField": "file_id",
+                "pipeline": [
+                    {"$limit": 1},
+                    {"$project": {
+                        "chunk_index": 1,
+                        "token_count": 1,
+                        "has_embedding": {"$ne": [{"$ifNull": ["$embedding", None]}, None]},
+                        "content_preview": {"$substrCP": [{"$ifNull": ["$content", ""]}, 0, 100]}
+                    }}
+                ],
+                "as": "sample_chunks"
+            }}
+        ]
+        file_records = {str(record["_id"]): record for record in db.dropbox_files.aggregate(pipeline)}
+        
+        # The sample chunk (a single index seek) already shows whether a file
+        # has chunks, so the full count only runs for those that do, in the
+        # background while the file details are printed
+        ids_with_chunks = [record["_id"] for record in file_records.values() if record["sample_chunks"]]
+        chunk_counts = executor.submit(count_chunks, db, ids_with_chunks) if ids_with_chunks else None
+        
+        for file_id in map(str, valid_ids):
+            print_file_status(file_id, file_records.get(file_id), chunk_counts, blob_checks.get(file_id))
+
+def check_file_status(file_id: str):
+    """Check the status of a file in MongoDB"""
+    check_files_status([file_id])
+
+def print_file_status(
+    file_id: str,
+    file_record: Optional[dict],
+    chunk_counts: Optional[Future],
+    blob_check: Optional[Future]
+):
+    """Print the status of one file from its aggregated record, chunk count and blob check"""
     if not file_record:
         print(f"File not found in MongoDB: {file_id}")
         return
@@ -64,35 +144,28 @@ def check_file_status(file_id: str):
     print(f"Updated At: {file_record.get('updated_at', 'N/A')}")
     
     # Check chunks
-    chunk_count = db.dropbox_chunks.count_documents({"file_id": file_obj_id})
+    chunk_count = 0
+    if file_record["sample_chunks"]:
+        chunk_count = chunk_counts.result().get(file_id, 0)
     print(f"\nChunks in Database: {chunk_count}")
     
-    if chunk_count > 0:
-        # Get sample chunk
-        sample_chunk = db.dropbox_chunks.find_one({"file_id": file_obj_id})
-        if sample_chunk:
-            has_embedding = "embedding" in sample_chunk and sample_chunk["embedding"] is not None
-            print(f"Sample Chunk:")
-            print(f"  - Index: {sample_chunk.get('chunk_index', 'N/A')}")
-            print(f"  - Has Embedding: {has_embedding}")
-            print(f"  - Token Count: {sample_chunk.get('token_count', 'N/A')}")
-            print(f"  - Content Preview: {sample_chunk.get('content', '')[:100]}...")
+    if file_record["sample_chunks"]:
+        sample_chunk = file_record["sample_chunks"][0]
+        print(f"Sample Chunk:")
+        print(f"  - Index: {sample_chunk.get('chunk_index', 'N/A')}")
+        print(f"  - Has Embedding: {sample_chunk['has_embedding']}")
+        print(f"  - Token Count: {sample_chunk.get('token_count', 'N/A')}")
+        print(f"  - Content Preview: {sample_chunk['content_preview']}...")
     
     # Check for markdown in blob storage
-    if BLOB_CONNECTION_STRING:
+    if blob_check:
         print("\n" + "=" * 60)
         print("BLOB STORAGE CHECK")
         print("=" * 60)
+        markdown_blob_name = f"markdown/{file_id}.md"
         try:
-            blob_service_client = BlobServiceClient.from_connection_string(BLOB_CONNECTION_STRING)
-            container_client = blob_service_client.get_container_client(BLOB_CONTAINER_NAME)
-            
-            # Blob path is markdown/{file_id}.md within the dropbox container
-            markdown_blob_name = f"markdown/{file_id}.md"
-            blob_client = container_client.get_blob_client(markdown_blob_name)
-            
-            if blob_client.exists():
-                props = blob_client.get_blob_properties()
+            props = blob_check.result()
+            if props:
                 print(f"\n✓ Markdown file exists in blob storage")
                 print(f"  Blob: {markdown_blob_name}")
                 print(f"  Size: {props.size:,} bytes")
@@ -104,11 +177,10 @@ def check_file_status(file_id: str):
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python check-status.py <file_id>")
+        print("Usage: python check-status.py <file_id> [<file_id> ...]")
         print("\nExample:")
         print("  python check-status.py 691c7c5e189bc4bbcb072913")
         sys.exit(1)
     
-    file_id = sys.argv[1]
-    check_file_status(file_id)
+    check_files_status(sys.argv[1:])
 
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Combined entry point for the admin and test scripts
+
+Runs several checks in one process so they share the MongoDB, Blob
+Storage and Service Bus clients from _clients instead of each script
+paying for its own connections:
+
+    python cli.py status <file_id> [<file_id> ...]
+    python cli.py queue
+    python cli.py details <file_id>
+    python cli.py test-upload <file_path> [dropbox_path]
+    python cli.py status <file_id> -- queue   # several commands, one process
+"""
+
+import argparse
+import importlib.util
+import sys
+from functools import cache
+from pathlib import Path
+
+SCRIPTS_DIR = Path(__file__).parent
+# Separates the commands when several are run in one process. Command
+# names alone are not used, since they could also be argument values
+# (e.g. a file literally named "queue").
+COMMAND_SEPARATOR = "--"
+
+
+@cache
+def load_script(filename: str):
+    """Import one of the hyphenated scripts (e.g. check-status.py) as a module"""
+    path = SCRIPTS_DIR / filename
+    spec = importlib.util.spec_from_file_location(path.stem.replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def cmd_status(args):
+    """Check the processing status of one or more files"""
+    load_script("check-status.py").check_files_status(args.file_ids)
+
+
+def cmd_queue(args):
+    """Check Service Bus queue status"""
+    load_script("check-queue.py").check_queue()
+
+
+def cmd_details(args):
+    """Show the full MongoDB record of a file"""
+    load_script("check-file-details.py").show_file_details(args.file_id)
+
+
+def cmd_test_upload(args):
+    """Upload a local file and queue it for processing"""
+    load_script("test-file-processing.py").process_file(args.file_path, args.dropbox_path)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser with one subcommand per script"""
+    parser = argparse.ArgumentParser(description="Dropbox-MongoDB admin tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    status = subparsers.add_parser("status", help=cmd_status.__doc__)
+    status.add_argument("file_ids", nargs="+", metavar="file_id")
+    status.set_defaults(func=cmd_status)
+    
+    queue = subparsers.add_parser("queue", help=cmd_queue.__doc__)
+    queue.set_defaults(func=cmd_queue)
+    
+    details = subparsers.add_parser("details", help=cmd_details.__doc__)
+    details.add_argument("file_id")
+    details.set_defaults(func=cmd_details)
+    
+    test_upload = subparsers.add_parser("test-upload", help=cmd_test_upload.__doc__)
+    test_upload.add_argument("file_path")
+    test_upload.add_argument("dropbox_path", nargs="?")
+    test_upload.set_defaults(func=cmd_test_upload)
+    
+    return parser
+
+
+def split_commands(argv):
+    """Split argv into one argument list per subcommand at each separator"""
+    groups = [[]]
+    for arg in argv:
+        if arg == COMMAND_SEPARATOR:
+            groups.append([])
+        else:
+            groups[-1].append(arg)
+    return groups
+
+
+def main(argv=None):
+    parser = build_parser()
+    argv = sys.argv[1:] if argv is None else argv
+    
+    # Parse every command first so a typo fails before anything runs
+    parsed = [parser.parse_args(group) for group in split_commands(argv)]
+    for args in parsed:
+        args.func(args)
+
+
+if __name__ == "__main__":
+    main()
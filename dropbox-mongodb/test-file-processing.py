@@ -9,87 +9,99 @@ This script:
 
 import os
 import sys
-import json
+import orjson
 import hashlib
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from dotenv import load_dotenv
-from azure.storage.blob import BlobServiceClient
-from azure.servicebus import ServiceBusClient, ServiceBusMessage
-from pymongo import MongoClient
-from bson import ObjectId
+
+from _clients import get_database, get_blob_service_client, get_servicebus_sender
+from _env import ENV_PATH, load_env
 
 # Load environment variables
-env_path = Path(__file__).parent / "worker" / ".env"
-if env_path.exists():
-    load_dotenv(env_path)
-else:
-    print(f"Warning: {env_path} not found. Using system environment variables.")
+if not ENV_PATH.exists():
+    print(f"Warning: {ENV_PATH} not found. Using system environment variables.")
+env = load_env()
 
 # Required environment variables
-MONGODB_URI = os.getenv("MONGODB_URI")
-MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "isaac-dropbox")
-BLOB_CONNECTION_STRING = os.getenv("BLOB_CONNECTION_STRING")
-BLOB_CONTAINER_NAME = os.getenv("BLOB_CONTAINER_NAME", "dropbox")
-SERVICE_BUS_CONNECTION_STRING = os.getenv("SERVICE_BUS_CONNECTION_STRING")
-SERVICE_BUS_QUEUE_NAME = os.getenv("SERVICE_BUS_QUEUE_NAME", "dropbox-file-processing")
+MONGODB_URI = env.MONGODB_URI
+BLOB_CONNECTION_STRING = env.BLOB_CONNECTION_STRING
+BLOB_CONTAINER_NAME = env.BLOB_CONTAINER_NAME
+SERVICE_BUS_CONNECTION_STRING = env.SERVICE_BUS_CONNECTION_STRING
+SERVICE_BUS_QUEUE_NAME = env.SERVICE_BUS_QUEUE_NAME
 
-def calculate_file_hash(file_path: str) -> str:
-    """Calculate SHA256 hash of file"""
-    sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest().lower()
+def read_file(file_path: str):
+    """Read a file once and return its content and SHA256 hash"""
+    content = Path(file_path).read_bytes()
+    # Hashed in C (OpenSSL, SHA-NI where available)
+    return content, hashlib.sha256(content).hexdigest()
 
-def upload_to_blob_storage(file_path: str, blob_name: str) -> str:
-    """Upload file to Azure Blob Storage and return URL"""
-    blob_service_client = BlobServiceClient.from_connection_string(BLOB_CONNECTION_STRING)
-    blob_client = blob_service_client.get_blob_client(
+def upload_to_blob_storage(file_path: str, content: bytes, blob_name: str) -> str:
+    """Upload file content to Azure Blob Storage and return URL"""
+    from azure.storage.blob import ContentSettings
+    
+    blob_client = get_blob_service_client().get_blob_client(
         container=BLOB_CONTAINER_NAME,
         blob=blob_name
     )
     
+    content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    
     print(f"   Uploading to blob: {blob_name}")
-    with open(file_path, "rb") as data:
-        blob_client.upload_blob(data, overwrite=True)
+    blob_client.upload_blob(
+        content,
+        overwrite=True,
+        length=len(content),
+        max_concurrency=8,
+        content_settings=ContentSettings(content_type=content_type)
+    )
+    
+    # The SDK already holds the blob URL (same as the backend sync uses)
+    return blob_client.url
+
+def find_existing_record(file_hash: str, dropbox_path: str):
+    """Find an existing MongoDB record for this file (duplicate check)"""
+    db = get_database()
     
-    # Get blob URL
-    storage_account = BLOB_CONNECTION_STRING.split("AccountName=")[1].split(";")[0]
-    blob_url = f"https://{storage_account}.blob.core.windows.net/{BLOB_CONTAINER_NAME}/{blob_name}"
-    return blob_url
+    # Use consistent dropbox_file_id based on hash for deduplication
+    dropbox_file_id = f"test:{file_hash[:16]}"
+    
+    # Check for existing file by dropbox_file_id (unique index point lookup),
+    # then fall back to file_hash + dropbox_path
+    duplicate_projection = {"_id": 1, "processing_status": 1}
+    existing = db.dropbox_files.find_one(
+        {"dropbox_file_id": dropbox_file_id},
+        duplicate_projection
+    )
+    if not existing:
+        existing = db.dropbox_files.find_one(
+            {"file_hash": file_hash, "dropbox_path": dropbox_path},
+            duplicate_projection
+        )
+    return existing
 
 def create_mongodb_record(
     file_path: str,
     blob_url: str,
     file_hash: str,
-    dropbox_path: str
+    dropbox_path: str,
+    existing=None
 ) -> str:
-    """Create MongoDB record and return file_id. Checks for duplicates first."""
-    client = MongoClient(MONGODB_URI)
-    db = client[MONGODB_DATABASE]
-    
-    file_info = Path(file_path)
-    file_size = file_info.stat().st_size
-    file_type = file_info.suffix.lstrip(".")
-    
-    # Use consistent dropbox_file_id based on hash for deduplication
-    dropbox_file_id = f"test:{file_hash[:16]}"
-    
-    # Check for existing file by dropbox_file_id or file_hash + dropbox_path
-    existing = db.dropbox_files.find_one({
-        "$or": [
-            {"dropbox_file_id": dropbox_file_id},
-            {"file_hash": file_hash, "dropbox_path": dropbox_path}
-        ]
-    })
-    
+    """Create MongoDB record and return file_id. Reuses the existing record if one was found."""
     if existing:
         file_id = str(existing["_id"])
         print(f"   File already exists (duplicate check): {file_id}")
         print(f"   Existing status: {existing.get('processing_status', 'unknown')}")
         return file_id
     
+    db = get_database()
+    
+    file_info = Path(file_path)
+    file_size = file_info.stat().st_size
+    file_type = file_info.suffix.lstrip(".")
+    dropbox_file_id = f"test:{file_hash[:16]}"
+    
     file_record = {
         "dropbox_path": dropbox_path,
         "dropbox_file_id": dropbox_file_id,
@@ -118,18 +130,16 @@ def create_mongodb_record(
     print(f"   Created MongoDB record: {file_id}")
     return file_id
 
-def send_queue_message(
+def build_queue_message(
     file_id: str,
     blob_url: str,
     filename: str,
     file_type: str,
     dropbox_path: str,
     dropbox_file_id: str
-):
-    """Send message to Service Bus queue"""
-    servicebus_client = ServiceBusClient.from_connection_string(SERVICE_BUS_CONNECTION_STRING)
-    
-    message_body = {
+) -> dict:
+    """Build the body of a Service Bus processing message"""
+    return {
         "message_type": "dropbox_file",
         "file_id": file_id,
         "dropbox_path": dropbox_path,
@@ -141,28 +151,35 @@ def send_queue_message(
         "metadata": {},
         "timestamp": datetime.utcnow().isoformat()
     }
+
+def send_queue_messages(message_bodies: list):
+    """Send messages to Service Bus queue in as few batches as possible"""
+    from azure.servicebus import ServiceBusMessage
     
-    message = ServiceBusMessage(
-        body=json.dumps(message_body),
-        content_type="application/json"
-    )
+    sender = get_servicebus_sender(SERVICE_BUS_QUEUE_NAME)
     
-    with servicebus_client:
-        sender = servicebus_client.get_queue_sender(queue_name=SERVICE_BUS_QUEUE_NAME)
-        with sender:
-            sender.send_messages(message)
+    batch = sender.create_message_batch()
+    for message_body in message_bodies:
+        message = ServiceBusMessage(
+            body=orjson.dumps(message_body),
+            content_type="application/json"
+        )
+        try:
+            batch.add_message(message)
+        except ValueError:
+            # Batch is full (size limit), send it and start a new one
+            sender.send_messages(batch)
+            batch = sender.create_message_batch()
+            batch.add_message(message)
     
-    print(f"   Message sent to queue: {SERVICE_BUS_QUEUE_NAME}")
-
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python test-file-processing.py <file_path> [dropbox_path]")
-        print("\nExample:")
-        print('  python test-file-processing.py "C:\\path\\to\\file.pptx" "/Company Docs/file.pptx"')
-        sys.exit(1)
+    if len(batch):
+        sender.send_messages(batch)
     
-    file_path = sys.argv[1]
-    dropbox_path = sys.argv[2] if len(sys.argv) > 2 else f"/test/{Path(file_path).name}"
+    print(f"   {len(message_bodies)} message(s) sent to queue: {SERVICE_BUS_QUEUE_NAME}")
+
+def process_file(file_path: str, dropbox_path: str = None):
+    """Upload a local file, create its MongoDB record and queue it for processing"""
+    dropbox_path = dropbox_path or f"/test/{Path(file_path).name}"
     
     # Validate file exists
     if not os.path.exists(file_path):
@@ -186,34 +203,43 @@ def main():
     print(f"\nFile: {file_path}")
     print(f"Dropbox Path: {dropbox_path}")
     
-    # Step 1: Calculate file hash
+    # Step 1: Calculate file hash. The blob name is derived from the hash,
+    # so the file is read once into memory and the upload reuses that
+    # buffer instead of reading the file from disk a second time.
     print("\n1. Calculating file hash...")
-    file_hash = calculate_file_hash(file_path)
+    content, file_hash = read_file(file_path)
     print(f"   Hash: {file_hash[:16]}...")
     
-    # Step 2: Upload to blob storage
+    # Step 2: Upload to blob storage, checking for a duplicate record
+    # concurrently (both only depend on the hash)
     print("\n2. Uploading to Azure Blob Storage...")
     filename = Path(file_path).name
     blob_name = f"dropbox/test/{file_hash}/{filename}"
-    blob_url = upload_to_blob_storage(file_path, blob_name)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        upload_future = executor.submit(upload_to_blob_storage, file_path, content, blob_name)
+        existing_future = executor.submit(find_existing_record, file_hash, dropbox_path)
+        blob_url = upload_future.result()
+        existing = existing_future.result()
     print(f"   Blob URL: {blob_url[:80]}...")
     
     # Step 3: Create MongoDB record
     print("\n3. Creating MongoDB record...")
-    file_id = create_mongodb_record(file_path, blob_url, file_hash, dropbox_path)
+    file_id = create_mongodb_record(file_path, blob_url, file_hash, dropbox_path, existing)
     
     # Step 4: Send message to queue
     print("\n4. Sending message to Service Bus queue...")
     file_type = Path(file_path).suffix.lstrip(".")
     dropbox_file_id = f"test:{file_hash[:16]}"
-    send_queue_message(
-        file_id=file_id,
-        blob_url=blob_url,
-        filename=filename,
-        file_type=file_type,
-        dropbox_path=dropbox_path,
-        dropbox_file_id=dropbox_file_id
-    )
+    send_queue_messages([
+        build_queue_message(
+            file_id=file_id,
+            blob_url=blob_url,
+            filename=filename,
+            file_type=file_type,
+            dropbox_path=dropbox_path,
+            dropbox_file_id=dropbox_file_id
+        )
+    ])
     
     print("\n" + "=" * 60)
     print("✓ File uploaded and queued for processing!")
@@ -229,6 +255,15 @@ def main():
     print("\n3. Check blob storage for markdown:")
     print(f"   Look for: dropbox/markdown/{file_id}.md")
 
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python test-file-processing.py <file_path> [dropbox_path]")
+        print("\nExample:")
+        print('  python test-file-processing.py "C:\\path\\to\\file.pptx" "/Company Docs/file.pptx"')
+        sys.exit(1)
+    
+    process_file(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else None)
+
 if __name__ == "__main__":
     main()
 
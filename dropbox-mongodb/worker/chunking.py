@@ -0,0 +1,99 @@
+"""
+Chunk post-processing shared by the worker and the local tester
+
+Keeping it in one place means the local tester previews exactly the
+chunks the worker stores.
+"""
+
+from typing import Callable, List, Tuple
+
+# Shortest suffix/prefix match treated as splitter overlap rather than
+# a coincidence between two unrelated chunks
+MIN_OVERLAP_CHARS = 20
+
+
+def join_chunks(first: str, second: str) -> str:
+    """
+    Join two neighbouring chunks, keeping text they share only once
+    
+    The splitters repeat the end of a chunk at the start of the next one
+    (chunk overlap), so the longest suffix of first that is also a prefix
+    of second is dropped from second before joining.
+    
+    Args:
+        first: Earlier chunk text (stripped)
+        second: Following chunk text (stripped)
+    
+    Returns:
+        Merged chunk text
+    """
+    # Candidate overlaps start where first's tail begins with second's
+    # first character; the earliest such start is the longest overlap
+    start = first.find(second[0], max(0, len(first) - len(second)))
+    while start != -1 and len(first) - start >= MIN_OVERLAP_CHARS:
+        if second.startswith(first[start:]):
+            return first + second[len(first) - start:]
+        start = first.find(second[0], start + 1)
+    return f"{first}\n\n{second}"
+
+
+def merge_small_chunks(
+    chunks_text: List[str],
+    token_counts: List[int],
+    min_tokens: int,
+    max_tokens: int,
+    count_tokens: Callable[[str], int]
+) -> Tuple[List[str], List[int]]:
+    """
+    Merge chunks under min_tokens into a neighbouring chunk
+    
+    A small chunk is appended to the previous chunk if the result stays
+    within max_tokens, otherwise it is prepended to the next one.
+    
+    Args:
+        chunks_text: Chunk texts in document order (stripped, non-empty)
+        token_counts: Token count of each chunk
+        min_tokens: Chunks with fewer tokens are merged
+        max_tokens: Largest merged chunk allowed
+        count_tokens: Token counter used to recount merged chunks
+    
+    Returns:
+        Merged chunk texts and their token counts
+    """
+    merged_text: List[str] = []
+    merged_counts: List[int] = []
+    carry_text, carry_count = None, 0
+    
+    for chunk_text, token_count in zip(chunks_text, token_counts):
+        # Prepend a small chunk carried over from before, if it fits
+        if carry_text is not None:
+            if carry_count + token_count <= max_tokens:
+                chunk_text = join_chunks(carry_text, chunk_text)
+                token_count += carry_count
+            else:
+                merged_text.append(carry_text)
+                merged_counts.append(carry_count)
+            carry_text = None
+        
+        if token_count >= min_tokens:
+            merged_text.append(chunk_text)
+            merged_counts.append(token_count)
+        elif merged_text and merged_counts[-1] + token_count <= max_tokens:
+            merged_text[-1] = join_chunks(merged_text[-1], chunk_text)
+            merged_counts[-1] += token_count
+        else:
+            carry_text, carry_count = chunk_text, token_count
+    
+    if carry_text is not None:
+        merged_text.append(carry_text)
+        merged_counts.append(carry_count)
+    
+    # The fit checks above add the counts of the chunks being joined, which
+    # overcounts any overlap they shared; merged chunks (the ones that are
+    # not one of the input strings) are recounted
+    unmerged = {id(chunk_text) for chunk_text in chunks_text}
+    for idx, chunk_text in enumerate(merged_text):
+        if id(chunk_text) not in unmerged:
+            merged_counts[idx] = count_tokens(chunk_text)
+    
+    return merged_text, merged_counts
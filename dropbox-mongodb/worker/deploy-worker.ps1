@@ -131,7 +131,7 @@ foreach ($varName in $expectedVars) {
 
 # Also include any other variables that start with expected prefixes
 Get-ChildItem Env: | Where-Object { 
-    $_.Name -match '^(MONGODB_|SERVICE_BUS_|BLOB_|OPENAI_|AZURE_OPENAI_|LOG_LEVEL|CHUNK_|MAX_)' -and 
+    $_.Name -match '^(MONGODB_|SERVICE_BUS_|BLOB_|OPENAI_|AZURE_OPENAI_|LOG_LEVEL|CHUNK_|MAX_|MIN_CHUNK_|EMBEDDING_|CONVERSION_|TEMP_DIR|PREFETCH_COUNT)' -and 
     -not $envVars.ContainsKey($_.Name)
 } | ForEach-Object {
     $envVars[$_.Name] = $_.Value
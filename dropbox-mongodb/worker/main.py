@@ -10,14 +10,24 @@ from __future__ import annotations
 
 import os
 import sys
+import io
+import gzip
 import json
+import time
 import asyncio
 import logging
 import hashlib
 import tempfile
+import threading
 import traceback
-from typing import Optional, Dict, Any, List
-from datetime import datetime
+import multiprocessing
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Optional, Dict, Any, List, Tuple, Union
+from datetime import datetime, timedelta
 from pathlib import Path
 
 # Print startup message immediately (before any imports that might fail)
@@ -28,13 +38,15 @@ sys.stdout.flush()
 try:
     print("Importing dependencies...", flush=True)
     import httpx
-    from azure.servicebus.aio import ServiceBusClient
+    from azure.servicebus.aio import ServiceBusClient, AutoLockRenewer
     from azure.servicebus import ServiceBusReceivedMessage, ServiceBusReceiveMode
     from azure.servicebus.exceptions import ServiceBusError
+    from azure.storage.blob import ContentSettings, BlobSasPermissions, generate_blob_sas
     from azure.storage.blob.aio import BlobServiceClient
     from motor.motor_asyncio import AsyncIOMotorClient
-    from pymongo import errors as mongo_errors
+    from pymongo import errors as mongo_errors, ReturnDocument
     from bson import ObjectId
+    from bson.binary import Binary, BinaryVectorDtype
     from openai import AsyncAzureOpenAI
     import tiktoken
     from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -48,12 +60,41 @@ except Exception as e:
     traceback.print_exc(file=sys.stderr)
     sys.exit(1)
 
+# Chunk post-processing shared with the local tester
+from chunking import merge_small_chunks
+
 # Docling imports
 try:
     from docling.document_converter import DocumentConverter
+    from docling.datamodel.base_models import InputFormat, DocumentStream, FormatToExtensions
     DOCLING_AVAILABLE = True
+    # File extensions docling can convert (e.g. not the legacy doc/ppt/xls)
+    DOCLING_FILE_TYPES = frozenset(
+        extension for extensions in FormatToExtensions.values() for extension in extensions
+    )
 except ImportError:
     DOCLING_AVAILABLE = False
+    DOCLING_FILE_TYPES = frozenset()
+
+# Fast JSON parsing for queue messages (falls back to the stdlib parser)
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# libuv-based event loop (falls back to asyncio's default loop if missing)
+try:
+    import uvloop
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+# Rust markdown splitter (falls back to langchain's splitter if missing)
+try:
+    from semantic_text_splitter import MarkdownSplitter
+    SEMANTIC_SPLITTER_AVAILABLE = True
+except ImportError:
+    SEMANTIC_SPLITTER_AVAILABLE = False
 
 # Set up logging to stdout for container
 logging.basicConfig(
@@ -63,6 +104,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Chunks per insert_many call (each chunk carries a ~25KB embedding)
+CHUNK_INSERT_BATCH_SIZE = 500
+
+# Files up to this size are downloaded and converted in memory; larger
+# files go through a temporary file to bound the worker's memory use
+IN_MEMORY_MAX_BYTES = 50 * 1024 * 1024
+
+# Embeddings kept in memory for reuse by identical chunks (~12KB each)
+EMBEDDING_CACHE_SIZE = 1024
+
+
+def file_sha256(file_path: str) -> str:
+    """Calculate SHA256 hash of a file"""
+    with open(file_path, "rb") as f:
+        # Hashes the whole file in C (OpenSSL, SHA-NI where available)
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
 
 class WorkerConfig:
     """Configuration settings for the Dropbox worker"""
@@ -83,6 +141,9 @@ class WorkerConfig:
         # Worker Settings
         self.max_receive_count = int(os.getenv("MAX_RECEIVE_COUNT", "3"))
         self.max_wait_time = int(os.getenv("MAX_WAIT_TIME", "60"))
+        self.max_concurrent_messages = int(os.getenv("MAX_CONCURRENT_MESSAGES", "4"))
+        self.max_lock_renewal_duration = int(os.getenv("MAX_LOCK_RENEWAL_DURATION", "3600"))
+        self.prefetch_count = int(os.getenv("PREFETCH_COUNT", "0"))
         self.temp_dir = os.getenv("TEMP_DIR", "/tmp/dropbox-worker")
         self.max_retries = int(os.getenv("MAX_RETRIES", "3"))
         self.retry_delay_base = float(os.getenv("RETRY_DELAY_BASE", "2.0"))
@@ -92,10 +153,16 @@ class WorkerConfig:
         self.openai_embedding_model = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-large")
         self.azure_openai_endpoint = os.getenv("AZURE_OPENAI_ENDPOINT", "")
         self.azure_openai_api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2023-05-15")
+        self.embedding_batch_size = int(os.getenv("EMBEDDING_BATCH_SIZE", "16"))
+        self.embedding_concurrency = int(os.getenv("EMBEDDING_CONCURRENCY", "8"))
         
         # Chunking Configuration
         self.chunk_size = int(os.getenv("CHUNK_SIZE", "512"))
         self.chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "50"))
+        self.min_chunk_tokens = int(os.getenv("MIN_CHUNK_TOKENS", "100"))
+        
+        # Document conversion processes (each loads its own docling models)
+        self.conversion_workers = int(os.getenv("CONVERSION_WORKERS", "1"))
         
         # Logging
         log_level = os.getenv("LOG_LEVEL", "INFO").upper()
@@ -117,25 +184,55 @@ class WorkerConfig:
         os.makedirs(self.temp_dir, exist_ok=True)
 
 
+# Document converter of a conversion pool process, created on first use
+_process_converter = None
+
+
+def _get_process_converter() -> "DocumentConverter":
+    """Get the document converter of the current conversion process"""
+    global _process_converter
+    if _process_converter is None:
+        _process_converter = DocumentConverter()
+    return _process_converter
+
+
+def _warm_up_converter():
+    """Load the PDF pipeline models in a conversion process"""
+    # The PDF pipeline carries the layout, OCR and table models;
+    # the office format pipelines are cheap to build on demand
+    _get_process_converter().initialize_pipeline(InputFormat.PDF)
+
+
+def _convert_document(source: Union[str, bytes], name: str) -> str:
+    """Convert a document (file path or file content) to markdown in a conversion process"""
+    if isinstance(source, bytes):
+        # Docling detects the format from the name's extension
+        source = DocumentStream(name=name, stream=io.BytesIO(source))
+    result = _get_process_converter().convert(source)
+    return result.document.export_to_markdown()
+
+
 class DoclingProcessor:
     """Process documents with docling for RAG"""
     
     def __init__(self, config: WorkerConfig):
         self.config = config
-        self.converter = None
+        self.pool = None
+        # Guards replacing or closing the pool; close() runs in a thread
+        self._pool_lock = threading.Lock()
         
         if DOCLING_AVAILABLE:
-            try:
-                self.converter = DocumentConverter()
-                logger.info("Docling converter initialized successfully")
-            except Exception as e:
-                logger.error(f"Failed to initialize docling converter: {e}")
-                self.converter = None
+            # Conversion is CPU-bound, so it runs in separate processes
+            # instead of blocking the event loop (and holding the GIL)
+            self.pool = self._create_pool()
+            logger.info(f"Docling conversion pool started ({config.conversion_workers} process(es))")
         else:
             logger.error("Docling not available. Install with: pip install docling")
         
         # Initialize Azure OpenAI client
         self.openai_client = None
+        self.embedding_semaphore = asyncio.Semaphore(config.embedding_concurrency)
+        self._embedding_lru: "OrderedDict[str, array]" = OrderedDict()
         if config.openai_api_key and config.azure_openai_endpoint:
             try:
                 self.openai_client = AsyncAzureOpenAI(
@@ -153,53 +250,192 @@ class DoclingProcessor:
         except Exception as e:
             logger.warning(f"Failed to load tiktoken encoding: {e}")
             self.encoding = None
+        
+        # The text splitter measures the same pieces of text many times while
+        # it recursively merges splits, so its length function is memoized
+        self._count_tokens_cached = lru_cache(maxsize=4096)(self.count_tokens)
+        
+        # Markdown splitter with the tokenizer built in (same cl100k_base
+        # encoding and token budget as the langchain fallback)
+        self.markdown_splitter = None
+        if SEMANTIC_SPLITTER_AVAILABLE:
+            try:
+                max_tokens = config.chunk_size * 4
+                overlap_tokens = config.chunk_overlap * 4
+                self.markdown_splitter = MarkdownSplitter.from_tiktoken_model(
+                    "gpt-3.5-turbo",  # cl100k_base
+                    capacity=(max_tokens - overlap_tokens, max_tokens),
+                    overlap=overlap_tokens
+                )
+            except Exception as e:
+                logger.warning(f"Failed to initialize markdown splitter: {e}")
+    
+    def _create_pool(self) -> ProcessPoolExecutor:
+        """Create the document conversion process pool"""
+        # Spawned rather than forked: the worker process already runs the
+        # Motor, Service Bus and Blob Storage client threads
+        return ProcessPoolExecutor(
+            max_workers=self.config.conversion_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    
+    async def warm_up(self):
+        """Load the docling models in every conversion process now instead of on the first message"""
+        if not self.pool:
+            return
+        
+        try:
+            start_time = time.perf_counter()
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*(
+                loop.run_in_executor(self.pool, _warm_up_converter)
+                for _ in range(self.config.conversion_workers)
+            ))
+            warm_up_time = time.perf_counter() - start_time
+            logger.info(f"Docling models loaded in {warm_up_time:.2f}s")
+        except Exception as e:
+            logger.warning(f"Failed to warm up docling converter: {e}")
     
-    def convert_to_markdown(self, file_path: str, file_type: str) -> Optional[str]:
+    async def convert_to_markdown(
+        self,
+        source: Union[str, bytes],
+        file_type: str,
+        name: str = "document"
+    ) -> Optional[str]:
         """
         Convert document to markdown using docling
         
         Args:
-            file_path: Path to the document file
+            source: Path to the document file, or the file content
             file_type: Type of file (pdf, docx, pptx, etc.)
+            name: Document name used for in-memory content (without extension)
             
         Returns:
             Markdown string or None if conversion fails
         """
-        if not self.converter:
+        # The pool this conversion runs on; another conversion may replace
+        # self.pool while this one is in flight
+        pool = self.pool
+        if not pool:
             logger.error("Docling converter not available")
             return None
         
         try:
-            logger.info(f"Converting {file_type} file to markdown: {file_path}")
-            start_time = datetime.now()
-            
-            # Convert document
-            result = self.converter.convert(file_path)
+            if isinstance(source, bytes):
+                logger.info(f"Converting {file_type} file to markdown: {name} ({len(source)} bytes in memory)")
+            else:
+                logger.info(f"Converting {file_type} file to markdown: {source}")
+            start_time = time.perf_counter()
             
-            # Export to markdown
-            markdown_content = result.document.export_to_markdown()
+            # Convert document and export to markdown in a conversion process
+            loop = asyncio.get_running_loop()
+            markdown_content = await loop.run_in_executor(
+                pool, _convert_document, source, f"{name}.{file_type}"
+            )
             
-            conversion_time = (datetime.now() - start_time).total_seconds()
+            conversion_time = time.perf_counter() - start_time
             logger.info(f"Document converted to markdown successfully in {conversion_time:.2f}s")
             logger.info(f"Markdown length: {len(markdown_content)} characters")
             
             return markdown_content
             
+        except BrokenProcessPool as e:
+            # A conversion process died (e.g. out of memory); replace the pool
+            # so later messages can still be converted. Every conversion that
+            # was running on the broken pool fails here, but only the first
+            # one replaces it; the others must not shut down (and cancel the
+            # conversions queued on) the new pool.
+            with self._pool_lock:
+                if self.pool is pool:
+                    logger.error(f"Conversion process failed, restarting pool: {e}")
+                    pool.shutdown(wait=False, cancel_futures=True)
+                    self.pool = self._create_pool()
+                else:
+                    logger.error(f"Conversion process failed, pool already restarted: {e}")
+            return None
+        except asyncio.CancelledError:
+            # Cancelling this task (shutdown) propagates; a conversion
+            # cancelled by its pool shutting down only fails this document
+            if asyncio.current_task().cancelling():
+                raise
+            logger.error("Document conversion was cancelled by a pool shutdown")
+            return None
         except Exception as e:
             logger.error(f"Failed to convert document to markdown: {e}")
             logger.error(traceback.format_exc())
             return None
     
+    def close(self):
+        """Shut down the conversion processes"""
+        with self._pool_lock:
+            pool, self.pool = self.pool, None
+        # Shut down outside the lock, which the event loop may be waiting on
+        if pool:
+            pool.shutdown(cancel_futures=True)
+    
     def count_tokens(self, text: str) -> int:
         """Count tokens in text"""
         if self.encoding:
             try:
-                return len(self.encoding.encode(text))
+                # encode_ordinary skips the special-token scan encode() runs
+                # over the whole text first (and its ValueError on document
+                # text that happens to contain "<|endoftext|>")
+                return len(self.encoding.encode_ordinary(text))
             except Exception:
                 pass
         # Fallback: rough estimate
         return len(text) // 4
     
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Count tokens in several texts with one tokenizer call"""
+        if self.encoding:
+            try:
+                return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(texts)]
+            except Exception:
+                pass
+        return [self.count_tokens(text) for text in texts]
+    
+    def _split_with_langchain(self, markdown_content: str) -> List[str]:
+        """Split markdown with langchain's RecursiveCharacterTextSplitter"""
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.config.chunk_size * 4,  # Approximate chars from tokens
+            chunk_overlap=self.config.chunk_overlap * 4,
+            length_function=self._count_tokens_cached,
+            separators=[
+                "\n\n## ",  # Major sections
+                "\n\n### ",  # Subsections
+                "\n\n",  # Paragraphs
+                "\n",  # Lines
+                ". ",  # Sentences
+                " ",  # Words
+                ""  # Characters
+            ]
+        )
+        return text_splitter.split_text(markdown_content)
+    
+    def _merge_small_chunks(
+        self,
+        chunks_text: List[str],
+        token_counts: List[int]
+    ) -> Tuple[List[str], List[int]]:
+        """
+        Merge chunks under min_chunk_tokens into a neighbouring chunk
+        
+        Args:
+            chunks_text: Chunk texts in document order
+            token_counts: Token count of each chunk
+            
+        Returns:
+            Merged chunk texts and their token counts
+        """
+        return merge_small_chunks(
+            chunks_text,
+            token_counts,
+            min_tokens=self.config.min_chunk_tokens,
+            max_tokens=(self.config.chunk_size + self.config.chunk_overlap) * 4,
+            count_tokens=self.count_tokens
+        )
+    
     def chunk_markdown(self, markdown_content: str) -> List[Dict[str, Any]]:
         """
         Chunk markdown content intelligently
@@ -211,42 +447,36 @@ class DoclingProcessor:
             List of chunk dictionaries with content and metadata
         """
         try:
-            # Use langchain's RecursiveCharacterTextSplitter for smart chunking
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=self.config.chunk_size * 4,  # Approximate chars from tokens
-                chunk_overlap=self.config.chunk_overlap * 4,
-                length_function=lambda x: self.count_tokens(x),
-                separators=[
-                    "\n\n## ",  # Major sections
-                    "\n\n### ",  # Subsections
-                    "\n\n",  # Paragraphs
-                    "\n",  # Lines
-                    ". ",  # Sentences
-                    " ",  # Words
-                    ""  # Characters
-                ]
-            )
+            if self.markdown_splitter:
+                # Split the markdown on headings, paragraphs, lines, sentences
+                # and words entirely in Rust
+                chunks_text = self.markdown_splitter.chunks(markdown_content)
+            else:
+                chunks_text = self._split_with_langchain(markdown_content)
+            
+            # Drop empty chunks
+            chunks_text = [stripped for chunk_text in chunks_text if (stripped := chunk_text.strip())]
+            
+            # Tokenize all chunks in one batch call
+            token_counts = self.count_tokens_batch(chunks_text)
             
-            # Split the markdown
-            chunks_text = text_splitter.split_text(markdown_content)
+            # Fold tiny fragments into their neighbours
+            chunks_text, token_counts = self._merge_small_chunks(chunks_text, token_counts)
             
             # Create chunk objects with metadata
             chunks = []
-            for idx, chunk_text in enumerate(chunks_text):
-                chunk_text = chunk_text.strip()
-                if not chunk_text:
-                    continue
-                
-                # Determine chunk type
-                chunk_type = "text"
-                if "|" in chunk_text and "---" in chunk_text:
+            for idx, (chunk_text, token_count) in enumerate(zip(chunks_text, token_counts)):
+                # Determine chunk type (chunk_text is stripped and non-empty).
+                # "---" is far rarer than "|", so checking it first usually
+                # settles the table test with a single scan.
+                if "---" in chunk_text and "|" in chunk_text:
                     chunk_type = "table"
-                elif chunk_text.startswith("- ") or chunk_text.startswith("* "):
+                elif chunk_text.startswith(("- ", "* ")):
                     chunk_type = "list"
-                elif chunk_text.startswith("#"):
+                elif chunk_text[0] == "#":
                     chunk_type = "heading"
-                
-                token_count = self.count_tokens(chunk_text)
+                else:
+                    chunk_type = "text"
                 
                 chunk = {
                     "chunk_index": idx,
@@ -267,47 +497,125 @@ class DoclingProcessor:
             logger.error(traceback.format_exc())
             return []
     
-    async def generate_embeddings(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def text_hash(self, text: str) -> str:
+        """Hash chunk text together with the embedding model (key for reusing embeddings)"""
+        return hashlib.sha256(f"{self.config.openai_embedding_model}|{text}".encode("utf-8")).hexdigest()
+    
+    async def _find_stored_embeddings(self, chunks_collection, text_hashes: List[str]) -> Dict[str, List[float]]:
+        """Look up one stored embedding for each of the text hashes that has any"""
+        pipeline = [
+            {"$match": {"text_hash": {"$in": text_hashes}}},
+            {"$group": {"_id": "$text_hash", "embedding": {"$first": "$embedding"}}}
+        ]
+        stored = {}
+        async for doc in chunks_collection.aggregate(pipeline):
+            embedding = doc["embedding"]
+            # BSON float32 vectors (older chunks store plain arrays)
+            if isinstance(embedding, Binary):
+                embedding = embedding.as_vector().data
+            stored[doc["_id"]] = embedding
+        return stored
+    
+    async def generate_embeddings(
+        self,
+        chunks: List[Dict[str, Any]],
+        chunks_collection=None
+    ) -> List[Dict[str, Any]]:
         """
         Generate Azure OpenAI embeddings for chunks
         
+        Chunks with the same text share one embedding, taken from the
+        in-process cache or an already stored chunk when available, so
+        only distinct new texts are sent to Azure OpenAI.
+        
         Args:
             chunks: List of chunk dictionaries
+            chunks_collection: dropbox_chunks collection to reuse stored embeddings from (optional)
             
         Returns:
-            List of chunks with embeddings added
+            List of chunks with embeddings (and text hashes) added
         """
         if not self.openai_client:
             logger.error("OpenAI client not available")
             return chunks
         
         try:
-            # Extract texts for embedding
-            texts = [chunk["content"] for chunk in chunks]
-            
-            if not texts:
+            if not chunks:
                 return chunks
             
-            logger.info(f"Generating embeddings for {len(texts)} chunks...")
+            # Group chunks by text hash
+            chunks_by_hash: Dict[str, List[Dict[str, Any]]] = {}
+            for chunk in chunks:
+                chunk["text_hash"] = self.text_hash(chunk["content"])
+                chunks_by_hash.setdefault(chunk["text_hash"], []).append(chunk)
+            
+            def assign(text_hash: str, embedding: List[float]):
+                for chunk in chunks_by_hash[text_hash]:
+                    chunk["embedding"] = embedding
+                self._remember_embedding(text_hash, embedding)
+            
+            # L1: in-process LRU
+            missing = []
+            for text_hash in chunks_by_hash:
+                vector = self._embedding_lru.get(text_hash)
+                if vector is not None:
+                    self._embedding_lru.move_to_end(text_hash)
+                    assign(text_hash, vector.tolist())
+                else:
+                    missing.append(text_hash)
             
-            # Generate embeddings in batch
-            response = await self.openai_client.embeddings.create(
-                model=self.config.openai_embedding_model,
-                input=texts
+            # L2: embeddings of identical chunks already in MongoDB
+            if missing and chunks_collection is not None:
+                try:
+                    stored = await self._find_stored_embeddings(chunks_collection, missing)
+                    for text_hash, embedding in stored.items():
+                        assign(text_hash, embedding)
+                    missing = [text_hash for text_hash in missing if text_hash not in stored]
+                except Exception as e:
+                    logger.warning(f"Stored embedding lookup failed: {e}")
+            
+            logger.info(
+                f"Generating embeddings for {len(missing)} distinct texts "
+                f"({len(chunks)} chunks, {len(chunks_by_hash) - len(missing)} reused)..."
             )
             
-            # Add embeddings to chunks
-            for idx, embedding_data in enumerate(response.data):
-                if idx < len(chunks):
-                    chunks[idx]["embedding"] = embedding_data.embedding
+            # Split into requests of at most embedding_batch_size inputs and
+            # send them concurrently, capped at embedding_concurrency in flight
+            # across all messages being processed
+            batch_size = self.config.embedding_batch_size
+            
+            async def embed_batch(start: int) -> int:
+                batch_hashes = missing[start:start + batch_size]
+                async with self.embedding_semaphore:
+                    response = await self.openai_client.embeddings.create(
+                        model=self.config.openai_embedding_model,
+                        input=[chunks_by_hash[text_hash][0]["content"] for text_hash in batch_hashes]
+                    )
+                
+                # Add embeddings to chunks
+                for embedding_data in response.data:
+                    assign(batch_hashes[embedding_data.index], embedding_data.embedding)
+                return len(response.data)
             
-            logger.info(f"Successfully generated {len(response.data)} embeddings")
+            generated = await asyncio.gather(
+                *(embed_batch(start) for start in range(0, len(missing), batch_size))
+            )
+            
+            logger.info(f"Successfully generated {sum(generated)} embeddings")
             return chunks
             
         except Exception as e:
             logger.error(f"Failed to generate embeddings: {e}")
             logger.error(traceback.format_exc())
             return chunks
+    
+    def _remember_embedding(self, text_hash: str, embedding: List[float]):
+        """Insert into the embedding LRU, evicting the least recently used entry"""
+        # Kept as packed float32 arrays, a quarter of the memory of a list of floats
+        self._embedding_lru[text_hash] = array("f", embedding)
+        self._embedding_lru.move_to_end(text_hash)
+        if len(self._embedding_lru) > EMBEDDING_CACHE_SIZE:
+            self._embedding_lru.popitem(last=False)
 
 
 class DropboxFileWorker:
@@ -320,6 +628,7 @@ class DropboxFileWorker:
         self.service_bus_client = None
         self.blob_service_client = None
         self.docling_processor = DoclingProcessor(config)
+        self.warm_up_task = None
         self.running = False
     
     async def connect_mongodb(self):
@@ -327,7 +636,13 @@ class DropboxFileWorker:
         try:
             logger.info(f"Connecting to MongoDB: {self.config.mongodb_database}")
             logger.info(f"MongoDB URI: {self.config.mongodb_uri[:50]}...")  # Log partial URI for debugging
-            self.mongo_client = AsyncIOMotorClient(self.config.mongodb_uri)
+            # Chunk inserts carry the chunk text alongside the embeddings,
+            # so requests are compressed on the wire (zlib is used if the
+            # server or the zstandard package does not support zstd)
+            self.mongo_client = AsyncIOMotorClient(
+                self.config.mongodb_uri,
+                compressors="zstd,zlib"
+            )
             self.database = self.mongo_client[self.config.mongodb_database]
             
             # Test connection
@@ -368,13 +683,32 @@ class DropboxFileWorker:
             logger.error(traceback.format_exc())
             raise
     
-    async def download_file_with_retry(self, blob_url: str, local_path: str) -> bool:
-        """Download file from Azure Blob Storage with retry logic"""
+    def _create_temp_path(self, file_type: str) -> str:
+        """Create an empty temporary file in the configured scratch directory"""
+        with tempfile.NamedTemporaryFile(
+            suffix=f".{file_type}",
+            delete=False,
+            dir=self.config.temp_dir
+        ) as temp_file:
+            return temp_file.name
+    
+    async def download_file_with_retry(self, blob_url: str, file_type: str) -> Union[bytes, str, None]:
+        """
+        Download file from Azure Blob Storage with retry logic
+        
+        Args:
+            blob_url: URL of the file to download
+            file_type: Type of file, used as the temporary file's extension
+            
+        Returns:
+            The file content for files up to IN_MEMORY_MAX_BYTES, the path of
+            a temporary file holding larger files, or None if all attempts failed
+        """
         last_error = None
         
         for attempt in range(self.config.max_retries):
             try:
-                return await self._download_file(blob_url, local_path)
+                return await self._download_file(blob_url, file_type)
                 
             except Exception as e:
                 last_error = e
@@ -387,21 +721,21 @@ class DropboxFileWorker:
                 else:
                     logger.error(f"Download failed after {self.config.max_retries} attempts: {e}")
         
-        return False
+        return None
     
-    async def _download_file(self, blob_url: str, local_path: str) -> bool:
+    async def _download_file(self, blob_url: str, file_type: str) -> Union[bytes, str]:
         """Download file from blob URL"""
         try:
             if self.blob_service_client and "blob.core.windows.net" in blob_url:
-                return await self._download_from_blob_storage(blob_url, local_path)
+                return await self._download_from_blob_storage(blob_url, file_type)
             else:
-                return await self._download_from_url(blob_url, local_path)
+                return await self._download_from_url(blob_url, file_type)
                 
         except Exception as e:
             logger.error(f"Failed to download file from {blob_url}: {e}")
             raise
     
-    async def _download_from_blob_storage(self, blob_url: str, local_path: str) -> bool:
+    async def _download_from_blob_storage(self, blob_url: str, file_type: str) -> Union[bytes, str]:
         """Download file from Azure Blob Storage using SDK"""
         try:
             # Parse blob URL to extract container and blob name
@@ -421,31 +755,53 @@ class DropboxFileWorker:
                 blob=blob_name
             )
             
-            with open(local_path, "wb") as download_file:
-                download_stream = await blob_client.download_blob()
-                async for chunk in download_stream.chunks():
-                    download_file.write(chunk)
+            # Large blobs are fetched as parallel range requests
+            download_stream = await blob_client.download_blob(max_concurrency=4)
+            if download_stream.size <= IN_MEMORY_MAX_BYTES:
+                content = await download_stream.readall()
+                logger.info(f"Downloaded blob {blob_name} ({len(content)} bytes) into memory")
+                return content
+            
+            # Written straight into the file by the SDK
+            local_path = self._create_temp_path(file_type)
+            try:
+                with open(local_path, "wb") as download_file:
+                    await download_stream.readinto(download_file)
+            except BaseException:
+                os.unlink(local_path)
+                raise
             
             logger.info(f"Downloaded blob {blob_name} to {local_path}")
-            return True
+            return local_path
             
         except Exception as e:
             logger.error(f"Failed to download from blob storage: {e}")
             raise
     
-    async def _download_from_url(self, url: str, local_path: str) -> bool:
+    async def _download_from_url(self, url: str, file_type: str) -> Union[bytes, str]:
         """Download file from HTTP URL as fallback"""
         try:
             async with httpx.AsyncClient(timeout=300.0) as client:
                 async with client.stream("GET", url) as response:
                     response.raise_for_status()
                     
-                    with open(local_path, "wb") as f:
-                        async for chunk in response.aiter_bytes():
-                            f.write(chunk)
+                    content_length = response.headers.get("content-length")
+                    if content_length and int(content_length) <= IN_MEMORY_MAX_BYTES:
+                        content = await response.aread()
+                        logger.info(f"Downloaded file from URL ({len(content)} bytes) into memory")
+                        return content
+                    
+                    local_path = self._create_temp_path(file_type)
+                    try:
+                        with open(local_path, "wb") as f:
+                            async for chunk in response.aiter_bytes(chunk_size=1024 * 1024):
+                                f.write(chunk)
+                    except BaseException:
+                        os.unlink(local_path)
+                        raise
             
             logger.info(f"Downloaded file from URL to {local_path}")
-            return True
+            return local_path
             
         except Exception as e:
             logger.error(f"Failed to download from URL: {e}")
@@ -454,8 +810,6 @@ class DropboxFileWorker:
     async def upload_markdown_to_blob(self, file_id: str, markdown_content: str) -> Optional[str]:
         """Upload markdown to blob storage and return URL with SAS token"""
         try:
-            from azure.storage.blob import ContentSettings
-            
             # Blob name should NOT include container name - it's already specified in get_blob_client
             markdown_blob_name = f"markdown/{file_id}.md"
             blob_client = self.blob_service_client.get_blob_client(
@@ -463,41 +817,32 @@ class DropboxFileWorker:
                 blob=markdown_blob_name
             )
             
-            # Run synchronous blob upload in thread pool
-            await asyncio.to_thread(
-                blob_client.upload_blob,
-                markdown_content.encode('utf-8'),
+            # Stored gzip-compressed (markdown shrinks several times over);
+            # HTTP clients reading the SAS URL decompress it transparently
+            # from the Content-Encoding header
+            await blob_client.upload_blob(
+                gzip.compress(markdown_content.encode('utf-8'), compresslevel=6),
                 overwrite=True,
-                content_settings=ContentSettings(content_type="text/markdown")
+                content_settings=ContentSettings(
+                    content_type="text/markdown; charset=utf-8",
+                    content_encoding="gzip"
+                )
             )
             
-            # Generate SAS token for read access
-            from azure.storage.blob import generate_blob_sas, BlobSasPermissions
-            from datetime import timedelta
-            
-            try:
-                connection_parts = dict(
-                    item.split('=', 1) 
-                    for item in self.config.blob_connection_string.split(';') 
-                    if '=' in item
+            # Generate SAS token for read access, signed with the account key
+            # the client already parsed from the connection string
+            account_key = getattr(self.blob_service_client.credential, "account_key", None)
+            markdown_url = blob_client.url
+            if account_key:
+                sas_token = generate_blob_sas(
+                    account_name=self.blob_service_client.account_name,
+                    container_name=self.config.blob_container_name,
+                    blob_name=markdown_blob_name,
+                    account_key=account_key,
+                    permission=BlobSasPermissions(read=True),
+                    expiry=datetime.utcnow() + timedelta(days=365)
                 )
-                account_name = connection_parts.get('AccountName')
-                account_key = connection_parts.get('AccountKey')
-                
-                if account_name and account_key:
-                    sas_token = generate_blob_sas(
-                        account_name=account_name,
-                        container_name=self.config.blob_container_name,
-                        blob_name=markdown_blob_name,
-                        account_key=account_key,
-                        permission=BlobSasPermissions(read=True),
-                        expiry=datetime.utcnow() + timedelta(days=365)
-                    )
-                    markdown_url = f"https://{account_name}.blob.core.windows.net/{self.config.blob_container_name}/{markdown_blob_name}?{sas_token}"
-                else:
-                    markdown_url = blob_client.url
-            except Exception:
-                markdown_url = blob_client.url
+                markdown_url = f"{blob_client.url}?{sas_token}"
             
             logger.info(f"Uploaded markdown to blob storage: {markdown_url[:100]}...")
             return markdown_url
@@ -506,6 +851,33 @@ class DropboxFileWorker:
             logger.error(f"Failed to upload markdown to blob storage: {e}")
             return None
     
+    async def skip_file(self, file_id: str, reason: str) -> bool:
+        """
+        Mark a file that can never be processed as skipped, without retries
+        
+        Unlike failed files, skipped files are not queued again by a sync
+        unless their content changes.
+        
+        Args:
+            file_id: MongoDB file record ID
+            reason: Error recorded on the file record
+            
+        Returns:
+            True, so the message is completed instead of redelivered
+        """
+        logger.warning(f"Skipping file {file_id}: {reason}")
+        await self.database.dropbox_files.update_one(
+            {"_id": ObjectId(file_id)},
+            {
+                "$set": {
+                    "processing_status": "skipped",
+                    "processing_metadata.last_error": reason,
+                    "updated_at": datetime.utcnow()
+                }
+            }
+        )
+        return True
+    
     async def process_dropbox_file(self, message: ServiceBusReceivedMessage) -> bool:
         """
         Process a Dropbox file from queue message
@@ -529,20 +901,19 @@ class DropboxFileWorker:
                 # Get message body - handle both bytes and string
                 message_body = message.body
                 
-                # Handle different body types
-                if isinstance(message_body, bytes):
-                    message_body = message_body.decode('utf-8')
-                elif isinstance(message_body, str):
-                    pass  # Already a string
+                # Handle different body types (bytes and str are parsed as-is,
+                # without decoding bytes first)
+                if isinstance(message_body, (bytes, bytearray, str)):
+                    pass
                 elif hasattr(message_body, '__iter__') and not isinstance(message_body, (str, bytes)):
                     # Handle generator/iterator (some SDK versions)
-                    message_body = b''.join(message_body).decode('utf-8')
+                    message_body = b''.join(message_body)
                 else:
                     # Fallback: convert to string
                     message_body = str(message_body)
                 
                 # Parse JSON
-                message_data = json.loads(message_body)
+                message_data = json_loads(message_body)
                 logger.info(f"Parsed message: file_id={message_data.get('file_id')}, filename={message_data.get('filename')}")
                 
             except (json.JSONDecodeError, AttributeError, TypeError, UnicodeDecodeError) as e:
@@ -563,18 +934,24 @@ class DropboxFileWorker:
             
             logger.info(f"Processing Dropbox file {file_id}: {filename}")
             
-            # Update status to processing
+            # Formats docling cannot read would fail on every delivery
+            if DOCLING_AVAILABLE and file_type.lower() not in DOCLING_FILE_TYPES:
+                return await self.skip_file(file_id, f"Unsupported file type: {file_type}")
+            
+            # Update status to processing, reading the state it had before
             try:
-                update_result = await self.database.dropbox_files.update_one(
+                previous_record = await self.database.dropbox_files.find_one_and_update(
                     {"_id": ObjectId(file_id)},
                     {
                         "$set": {
                             "processing_status": "processing",
                             "updated_at": datetime.utcnow()
                         }
-                    }
+                    },
+                    projection={"processing_status": 1, "content_sha256": 1},
+                    return_document=ReturnDocument.BEFORE
                 )
-                if update_result.matched_count == 0:
+                if previous_record is None:
                     logger.error(f"File record not found in MongoDB: {file_id}")
                     return False
                 logger.info(f"Updated file status to 'processing'")
@@ -583,17 +960,43 @@ class DropboxFileWorker:
                 logger.error(traceback.format_exc())
                 return False
             
-            # Create temporary file
-            with tempfile.NamedTemporaryFile(suffix=f".{file_type}", delete=False) as temp_file:
-                temp_path = temp_file.name
-            
+            # Content of the downloaded file, or the path of the temporary
+            # file holding it if it is too large to keep in memory
+            source = None
             try:
                 # Download file with retry logic
-                if not await self.download_file_with_retry(blob_url, temp_path):
+                source = await self.download_file_with_retry(blob_url, file_type)
+                if source is None:
                     raise Exception("Failed to download file after retries")
+                if isinstance(source, bytes) and not source:
+                    return await self.skip_file(file_id, "File is empty")
+                
+                # Skip files whose exact content was already processed (e.g. a
+                # re-delivered message); chunks and markdown are already stored
+                if isinstance(source, bytes):
+                    content_sha256 = await asyncio.to_thread(
+                        lambda: hashlib.sha256(source).hexdigest()
+                    )
+                else:
+                    content_sha256 = await asyncio.to_thread(file_sha256, source)
+                if (
+                    previous_record.get("processing_status") == "completed"
+                    and previous_record.get("content_sha256") == content_sha256
+                ):
+                    logger.info(f"File {file_id} already processed with the same content, skipping")
+                    await self.database.dropbox_files.update_one(
+                        {"_id": ObjectId(file_id)},
+                        {
+                            "$set": {
+                                "processing_status": "completed",
+                                "updated_at": datetime.utcnow()
+                            }
+                        }
+                    )
+                    return True
                 
                 # Convert to markdown
-                markdown_content = self.docling_processor.convert_to_markdown(temp_path, file_type)
+                markdown_content = await self.docling_processor.convert_to_markdown(source, file_type, name=file_id)
                 if not markdown_content:
                     raise Exception("Failed to convert to markdown")
                 
@@ -613,6 +1016,7 @@ class DropboxFileWorker:
                                 "processing_status": "completed",
                                 "markdown_blob_url": markdown_blob_url,
                                 "chunk_count": 0,
+                                "content_sha256": content_sha256,
                                 "updated_at": datetime.utcnow()
                             }
                         }
@@ -620,39 +1024,67 @@ class DropboxFileWorker:
                     return True
                 
                 # Generate embeddings
-                chunks_with_embeddings = await self.docling_processor.generate_embeddings(chunks)
+                chunks_with_embeddings = await self.docling_processor.generate_embeddings(
+                    chunks,
+                    chunks_collection=self.database.dropbox_chunks
+                )
                 
-                # Prepare document chunks for insertion
+                # Prepare document chunks for insertion (one timestamp and one
+                # parsed file ID shared by every chunk and the completion update)
+                completed_at = datetime.utcnow()
+                file_oid = ObjectId(file_id)
                 document_chunks = []
+                # A file is only recorded as completed (with its content hash,
+                # which later deliveries of the same content skip on) when
+                # every chunk was embedded; otherwise it fails and is retried
+                missing_embeddings = sum(1 for chunk in chunks_with_embeddings if "embedding" not in chunk)
+                if missing_embeddings:
+                    raise Exception(f"Failed to generate embeddings for {missing_embeddings} of {len(chunks)} chunks")
+                
                 for chunk in chunks_with_embeddings:
-                    if "embedding" not in chunk:
-                        logger.warning(f"Chunk {chunk['chunk_index']} missing embedding, skipping")
-                        continue
-                    
                     doc_chunk = {
-                        "file_id": ObjectId(file_id),
+                        "file_id": file_oid,
+                        "file_type": file_type,  # Denormalized for vector search pre-filters
                         "chunk_index": chunk["chunk_index"],
                         "content": chunk["content"],
-                        "embedding": chunk["embedding"],
+                        "text_hash": chunk["text_hash"],  # Lets identical chunks reuse this embedding
+                        # Stored as a BSON float32 vector: half the size of an
+                        # array of doubles, and indexed as-is by $vectorSearch
+                        "embedding": Binary.from_vector(chunk["embedding"], BinaryVectorDtype.FLOAT32),
                         "metadata": chunk.get("metadata", {}),
-                        "created_at": datetime.utcnow()
+                        "created_at": completed_at
                     }
                     document_chunks.append(doc_chunk)
                 
-                # Insert chunks into MongoDB
-                if document_chunks:
-                    await self.database.dropbox_chunks.insert_many(document_chunks)
-                    logger.info(f"Inserted {len(document_chunks)} document chunks for file {file_id}")
+                # Insert chunks into MongoDB in concurrent unordered batches.
+                # Every batch must succeed before the file is marked completed,
+                # so a failed or interrupted insert never leaves a completed
+                # record pointing at chunks that do not exist.
+                results = await asyncio.gather(
+                    *(
+                        self.database.dropbox_chunks.insert_many(
+                            document_chunks[start:start + CHUNK_INSERT_BATCH_SIZE],
+                            ordered=False
+                        )
+                        for start in range(0, len(document_chunks), CHUNK_INSERT_BATCH_SIZE)
+                    ),
+                    return_exceptions=True
+                )
+                for result in results:
+                    if isinstance(result, Exception):
+                        raise result
+                logger.info(f"Inserted {len(document_chunks)} document chunks for file {file_id}")
                 
                 # Update file record with completion status
                 await self.database.dropbox_files.update_one(
-                    {"_id": ObjectId(file_id)},
+                    {"_id": file_oid},
                     {
                         "$set": {
                             "processing_status": "completed",
                             "markdown_blob_url": markdown_blob_url,
                             "chunk_count": len(document_chunks),
-                            "updated_at": datetime.utcnow()
+                            "content_sha256": content_sha256,
+                            "updated_at": completed_at
                         }
                     }
                 )
@@ -661,11 +1093,12 @@ class DropboxFileWorker:
                 return True
                 
             finally:
-                # Clean up temporary file
-                try:
-                    os.unlink(temp_path)
-                except Exception:
-                    pass
+                # Clean up temporary file (in-memory downloads have none)
+                if isinstance(source, str):
+                    try:
+                        os.unlink(source)
+                    except Exception:
+                        pass
             
         except Exception as e:
             logger.error(f"Failed to process Dropbox file: {e}")
@@ -689,11 +1122,50 @@ class DropboxFileWorker:
             
             return False
     
+    async def handle_message(self, receiver, msg: ServiceBusReceivedMessage):
+        """Process one message and settle it (complete, abandon or dead-letter)"""
+        try:
+            success = await self.process_dropbox_file(msg)
+            
+            if success:
+                await receiver.complete_message(msg)
+                logger.info("Message processed successfully and completed")
+            else:
+                # Check delivery count for dead-lettering
+                delivery_count = getattr(msg, 'delivery_count', 1)
+                if delivery_count >= self.config.max_receive_count:
+                    await receiver.dead_letter_message(
+                        msg,
+                        reason="MaxDeliveryCountExceeded",
+                        error_description=f"Message failed processing after {delivery_count} attempts"
+                    )
+                    logger.error(f"Message dead-lettered after {delivery_count} delivery attempts")
+                else:
+                    await receiver.abandon_message(msg)
+                    logger.warning(f"Message processing failed, abandoned (attempt {delivery_count}/{self.config.max_receive_count})")
+                    
+        except ServiceBusError as e:
+            logger.error(f"Service Bus error processing message: {e}")
+            await asyncio.sleep(1)
+        except Exception as e:
+            logger.error(f"Unexpected error processing message: {e}")
+            try:
+                await receiver.abandon_message(msg)
+            except Exception:
+                logger.error("Failed to abandon message after error")
+    
     async def run(self):
         """Main worker loop"""
         logger.info("Starting Dropbox File Processing Worker")
         
         try:
+            # Load the docling models in the background while connecting and
+            # while the first messages download. It is not awaited: the
+            # first conversions queue behind it in the conversion pool, so
+            # a cold start costs max(download, model load), not their sum.
+            self.warm_up_task = asyncio.create_task(self.docling_processor.warm_up())
+            self.warm_up_task.add_done_callback(self._log_warm_up_failure)
+            
             # Connect to services
             await self.connect_mongodb()
             await self.connect_service_bus()
@@ -701,57 +1173,54 @@ class DropboxFileWorker:
             
             self.running = True
             
+            # Keep the locks of messages being processed alive; a large
+            # document can take longer than the queue's lock duration
+            lock_renewer = AutoLockRenewer(
+                max_lock_renewal_duration=self.config.max_lock_renewal_duration
+            )
+            
             # Start message processing loop
-            async with self.service_bus_client.get_queue_receiver(
+            async with lock_renewer, self.service_bus_client.get_queue_receiver(
                 queue_name=self.config.service_bus_queue_name,
                 max_wait_time=self.config.max_wait_time,
-                receive_mode=ServiceBusReceiveMode.PEEK_LOCK
+                receive_mode=ServiceBusReceiveMode.PEEK_LOCK,
+                prefetch_count=self.config.prefetch_count,
+                auto_lock_renewer=lock_renewer
             ) as receiver:
                 
                 logger.info(f"Listening for messages on queue: {self.config.service_bus_queue_name}")
                 
-                while self.running:
-                    try:
-                        # Receive messages
-                        received_msgs = await receiver.receive_messages(
-                            max_message_count=1,
-                            max_wait_time=10
-                        )
+                # Messages being processed; each one moves through download,
+                # conversion, embedding and insert independently and is
+                # settled as soon as it finishes, so a large document does
+                # not hold up the settlement of the others. The task group
+                # lets messages already received finish and settle before
+                # the receiver closes.
+                in_flight = set()
+                
+                async with asyncio.TaskGroup() as task_group:
+                    while self.running:
+                        try:
+                            free_slots = self.config.max_concurrent_messages - len(in_flight)
+                            if free_slots <= 0:
+                                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                                continue
+                            
+                            # Receive only as many messages as can start now, so
+                            # none sits locked while waiting for a free slot
+                            received_msgs = await receiver.receive_messages(
+                                max_message_count=free_slots,
+                                max_wait_time=10
+                            )
+                            
+                            for msg in received_msgs:
+                                task = task_group.create_task(self.handle_message(receiver, msg))
+                                in_flight.add(task)
+                                task.add_done_callback(in_flight.discard)
                         
-                        for msg in received_msgs:
-                            try:
-                                success = await self.process_dropbox_file(msg)
-                                
-                                if success:
-                                    await receiver.complete_message(msg)
-                                    logger.info("Message processed successfully and completed")
-                                else:
-                                    # Check delivery count for dead-lettering
-                                    delivery_count = getattr(msg, 'delivery_count', 1)
-                                    if delivery_count >= self.config.max_receive_count:
-                                        await receiver.dead_letter_message(
-                                            msg,
-                                            reason="MaxDeliveryCountExceeded",
-                                            error_description=f"Message failed processing after {delivery_count} attempts"
-                                        )
-                                        logger.error(f"Message dead-lettered after {delivery_count} delivery attempts")
-                                    else:
-                                        await receiver.abandon_message(msg)
-                                        logger.warning(f"Message processing failed, abandoned (attempt {delivery_count}/{self.config.max_receive_count})")
-                                        
-                            except ServiceBusError as e:
-                                logger.error(f"Service Bus error processing message: {e}")
-                                await asyncio.sleep(1)
-                            except Exception as e:
-                                logger.error(f"Unexpected error processing message: {e}")
-                                try:
-                                    await receiver.abandon_message(msg)
-                                except Exception:
-                                    logger.error("Failed to abandon message after error")
-                    
-                    except Exception as e:
-                        logger.error(f"Error in message processing loop: {e}")
-                        await asyncio.sleep(5)
+                        except Exception as e:
+                            logger.error(f"Error in message processing loop: {e}")
+                            await asyncio.sleep(5)
         
         except Exception as e:
             logger.error(f"Fatal error in worker: {e}")
@@ -760,18 +1229,36 @@ class DropboxFileWorker:
         finally:
             await self.cleanup()
     
+    @staticmethod
+    def _log_warm_up_failure(task: asyncio.Task):
+        """Log an exception that escaped the docling warm-up task"""
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Docling warm-up failed: {task.exception()}")
+    
     async def cleanup(self):
         """Clean up connections"""
         logger.info("Cleaning up worker connections")
         
-        if self.service_bus_client:
-            await self.service_bus_client.close()
+        # Stop a warm-up that is still running before its pool shuts down
+        if self.warm_up_task and not self.warm_up_task.done():
+            self.warm_up_task.cancel()
+            await asyncio.gather(self.warm_up_task, return_exceptions=True)
         
+        # The connections are independent, so they are closed concurrently;
+        # the blocking closes (MongoDB pools, conversion processes) run in
+        # threads so they do not hold up the others
+        closers = {"docling conversion pool": asyncio.to_thread(self.docling_processor.close)}
+        if self.service_bus_client:
+            closers["Service Bus"] = self.service_bus_client.close()
         if self.blob_service_client:
-            await self.blob_service_client.close()
-        
+            closers["Blob Storage"] = self.blob_service_client.close()
         if self.mongo_client:
-            self.mongo_client.close()
+            closers["MongoDB"] = asyncio.to_thread(self.mongo_client.close)
+        
+        results = await asyncio.gather(*closers.values(), return_exceptions=True)
+        for name, result in zip(closers, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to close {name}: {result}")
     
     def stop(self):
         """Stop the worker gracefully"""
@@ -822,8 +1309,12 @@ if __name__ == "__main__":
             # Fallback if reconfigure not available
             pass
         
-        # Run main
-        asyncio.run(main())
+        # Run main (on uvloop when installed)
+        if UVLOOP_AVAILABLE:
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                runner.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         print("Received keyboard interrupt", flush=True)
         sys.exit(0)
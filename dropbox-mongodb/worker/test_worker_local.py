@@ -9,16 +9,20 @@ Usage:
     python test_worker_local.py --file "test.pdf"
     python test_worker_local.py --file "test.docx" --output-dir "./output"
     python test_worker_local.py --file "test.pdf" --with-embeddings
+    python test_worker_local.py --file "test.pdf" --no-ocr
 """
 
 import os
 import sys
 import json
+import time
 import argparse
 import logging
+from array import array
+from collections import Counter
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Dict, Any, List
-from datetime import datetime
 
 # Add parent directory to path if needed
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -32,7 +36,9 @@ logger = logging.getLogger(__name__)
 
 # Import docling
 try:
-    from docling.document_converter import DocumentConverter
+    from docling.document_converter import DocumentConverter, PdfFormatOption
+    from docling.datamodel.base_models import InputFormat
+    from docling.datamodel.pipeline_options import PdfPipelineOptions
     DOCLING_AVAILABLE = True
 except ImportError:
     DOCLING_AVAILABLE = False
@@ -42,6 +48,23 @@ except ImportError:
 import tiktoken
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
+# Chunk post-processing shared with the worker
+from chunking import merge_small_chunks
+
+# Rust markdown splitter used by the worker (falls back to langchain's splitter)
+try:
+    from semantic_text_splitter import MarkdownSplitter
+    SEMANTIC_SPLITTER_AVAILABLE = True
+except ImportError:
+    SEMANTIC_SPLITTER_AVAILABLE = False
+
+# Fast JSON serialization for the chunks file (optional)
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
 # Import OpenAI for embeddings (optional)
 try:
     from openai import AsyncAzureOpenAI
@@ -61,17 +84,34 @@ class LocalDoclingTester:
         chunk_overlap: int = 50,
         openai_api_key: Optional[str] = None,
         azure_endpoint: Optional[str] = None,
-        embedding_model: str = "text-embedding-3-large"
+        embedding_model: str = "text-embedding-3-large",
+        embedding_batch_size: int = 16,
+        embedding_concurrency: int = 8,
+        do_ocr: bool = True,
+        min_chunk_tokens: int = 100
     ):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
+        self.min_chunk_tokens = min_chunk_tokens
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_concurrency = embedding_concurrency
         
         # Initialize docling converter
         self.converter = None
         if DOCLING_AVAILABLE:
             try:
-                self.converter = DocumentConverter()
-                logger.info("✓ Docling converter initialized")
+                if do_ocr:
+                    # Same defaults as the worker
+                    self.converter = DocumentConverter()
+                else:
+                    # Born-digital PDFs carry their text, so the OCR models
+                    # need not be loaded or run
+                    self.converter = DocumentConverter(format_options={
+                        InputFormat.PDF: PdfFormatOption(
+                            pipeline_options=PdfPipelineOptions(do_ocr=False)
+                        )
+                    })
+                logger.info(f"✓ Docling converter initialized (OCR {'on' if do_ocr else 'off'})")
             except Exception as e:
                 logger.error(f"Failed to initialize docling: {e}")
         
@@ -83,6 +123,25 @@ class LocalDoclingTester:
             logger.warning(f"Failed to load tokenizer: {e}")
             self.encoding = None
         
+        # The text splitter measures the same pieces of text many times while
+        # it recursively merges splits, so its length function is memoized
+        self._count_tokens_cached = lru_cache(maxsize=4096)(self.count_tokens)
+        
+        # Markdown splitter with the tokenizer built in (same settings as
+        # the worker's DoclingProcessor)
+        self.markdown_splitter = None
+        if SEMANTIC_SPLITTER_AVAILABLE:
+            try:
+                max_tokens = chunk_size * 4
+                overlap_tokens = chunk_overlap * 4
+                self.markdown_splitter = MarkdownSplitter.from_tiktoken_model(
+                    "gpt-3.5-turbo",  # cl100k_base
+                    capacity=(max_tokens - overlap_tokens, max_tokens),
+                    overlap=overlap_tokens
+                )
+            except Exception as e:
+                logger.warning(f"Failed to initialize markdown splitter: {e}")
+        
         # Initialize OpenAI client (optional)
         self.openai_client = None
         if OPENAI_AVAILABLE and openai_api_key and azure_endpoint:
@@ -101,11 +160,22 @@ class LocalDoclingTester:
         """Count tokens in text"""
         if self.encoding:
             try:
-                return len(self.encoding.encode(text))
+                # encode_ordinary skips the special-token scan encode() runs
+                # over the whole text first
+                return len(self.encoding.encode_ordinary(text))
             except Exception:
                 pass
         return len(text) // 4
     
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Count tokens in several texts with one tokenizer call"""
+        if self.encoding:
+            try:
+                return [len(tokens) for tokens in self.encoding.encode_ordinary_batch(texts)]
+            except Exception:
+                pass
+        return [self.count_tokens(text) for text in texts]
+    
     def convert_to_markdown(self, file_path: str) -> Optional[str]:
         """Convert document to markdown"""
         if not self.converter:
@@ -114,7 +184,7 @@ class LocalDoclingTester:
         
         try:
             logger.info(f"Converting file to markdown: {file_path}")
-            start_time = datetime.now()
+            start_time = time.perf_counter()
             
             # Convert document
             result = self.converter.convert(file_path)
@@ -122,7 +192,7 @@ class LocalDoclingTester:
             # Export to markdown
             markdown_content = result.document.export_to_markdown()
             
-            conversion_time = (datetime.now() - start_time).total_seconds()
+            conversion_time = time.perf_counter() - start_time
             logger.info(f"✓ Conversion completed in {conversion_time:.2f}s")
             logger.info(f"  Markdown length: {len(markdown_content):,} characters")
             logger.info(f"  Estimated tokens: {self.count_tokens(markdown_content):,}")
@@ -135,44 +205,64 @@ class LocalDoclingTester:
             traceback.print_exc()
             return None
     
+    def _split_with_langchain(self, markdown_content: str) -> List[str]:
+        """Split markdown with langchain's RecursiveCharacterTextSplitter"""
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size * 4,
+            chunk_overlap=self.chunk_overlap * 4,
+            length_function=self._count_tokens_cached,
+            separators=[
+                "\n\n## ",
+                "\n\n### ",
+                "\n\n",
+                "\n",
+                ". ",
+                " ",
+                ""
+            ]
+        )
+        return text_splitter.split_text(markdown_content)
+    
     def chunk_markdown(self, markdown_content: str) -> List[Dict[str, Any]]:
         """Chunk markdown content"""
         try:
             logger.info("Chunking markdown content...")
             
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=self.chunk_size * 4,
-                chunk_overlap=self.chunk_overlap * 4,
-                length_function=lambda x: self.count_tokens(x),
-                separators=[
-                    "\n\n## ",
-                    "\n\n### ",
-                    "\n\n",
-                    "\n",
-                    ". ",
-                    " ",
-                    ""
-                ]
-            )
+            if self.markdown_splitter:
+                # Split the markdown on headings, paragraphs, lines, sentences
+                # and words in one pass in Rust, like the worker
+                chunks_text = self.markdown_splitter.chunks(markdown_content)
+            else:
+                chunks_text = self._split_with_langchain(markdown_content)
+            
+            # Drop empty chunks
+            chunks_text = [stripped for chunk_text in chunks_text if (stripped := chunk_text.strip())]
             
-            chunks_text = text_splitter.split_text(markdown_content)
+            # Tokenize every chunk in one call (tiktoken encodes the batch on
+            # its own threads, outside the GIL)
+            token_counts = self.count_tokens_batch(chunks_text)
+            
+            # Fold tiny fragments into their neighbours, exactly as the worker does
+            chunks_text, token_counts = merge_small_chunks(
+                chunks_text,
+                token_counts,
+                min_tokens=self.min_chunk_tokens,
+                max_tokens=(self.chunk_size + self.chunk_overlap) * 4,
+                count_tokens=self.count_tokens
+            )
             
             chunks = []
-            for idx, chunk_text in enumerate(chunks_text):
-                chunk_text = chunk_text.strip()
-                if not chunk_text:
-                    continue
-                
-                # Determine chunk type
-                chunk_type = "text"
-                if "|" in chunk_text and "---" in chunk_text:
+            for idx, (chunk_text, token_count) in enumerate(zip(chunks_text, token_counts)):
+                # Determine chunk type (same rules as the worker; "---" is
+                # rarer than "|", so it is checked first)
+                if "---" in chunk_text and "|" in chunk_text:
                     chunk_type = "table"
-                elif chunk_text.startswith("- ") or chunk_text.startswith("* "):
+                elif chunk_text.startswith(("- ", "* ")):
                     chunk_type = "list"
-                elif chunk_text.startswith("#"):
+                elif chunk_text[0] == "#":
                     chunk_type = "heading"
-                
-                token_count = self.count_tokens(chunk_text)
+                else:
+                    chunk_type = "text"
                 
                 chunk = {
                     "chunk_index": idx,
@@ -185,15 +275,12 @@ class LocalDoclingTester:
             
             logger.info(f"✓ Created {len(chunks)} chunks")
             
-            # Show stats
-            token_counts = [c["token_count"] for c in chunks]
+            # Show stats (every counted chunk became a chunk)
             logger.info(f"  Token counts - min: {min(token_counts)}, max: {max(token_counts)}, avg: {sum(token_counts)/len(token_counts):.1f}")
             
             # Show chunk type distribution
-            chunk_types = {}
-            for c in chunks:
-                chunk_types[c["chunk_type"]] = chunk_types.get(c["chunk_type"], 0) + 1
-            logger.info(f"  Chunk types: {chunk_types}")
+            chunk_types = Counter(c["chunk_type"] for c in chunks)
+            logger.info(f"  Chunk types: {dict(chunk_types)}")
             
             return chunks
             
@@ -213,18 +300,32 @@ class LocalDoclingTester:
             texts = [chunk["content"] for chunk in chunks]
             logger.info(f"Generating embeddings for {len(texts)} chunks...")
             
-            start_time = datetime.now()
-            response = await self.openai_client.embeddings.create(
-                model=self.embedding_model,
-                input=texts
-            )
+            start_time = time.perf_counter()
             
-            for idx, embedding_data in enumerate(response.data):
-                if idx < len(chunks):
-                    chunks[idx]["embedding"] = embedding_data.embedding
-                    chunks[idx]["embedding_dim"] = len(embedding_data.embedding)
+            # Split into requests of at most embedding_batch_size inputs and
+            # run up to embedding_concurrency of them at once; the client
+            # retries a throttled (429) request on its own, without resending
+            # the rest of the document
+            semaphore = asyncio.Semaphore(self.embedding_concurrency)
             
-            generation_time = (datetime.now() - start_time).total_seconds()
+            async def embed_batch(start: int):
+                async with semaphore:
+                    response = await self.openai_client.embeddings.create(
+                        model=self.embedding_model,
+                        input=texts[start:start + self.embedding_batch_size]
+                    )
+                for embedding_data in response.data:
+                    chunk = chunks[start + embedding_data.index]
+                    # Kept as a packed float32 array: 4 bytes per dimension
+                    # instead of a list of ~32 byte Python floats
+                    chunk["embedding"] = array("f", embedding_data.embedding)
+                    chunk["embedding_dim"] = len(chunk["embedding"])
+            
+            await asyncio.gather(*(
+                embed_batch(start) for start in range(0, len(texts), self.embedding_batch_size)
+            ))
+            
+            generation_time = time.perf_counter() - start_time
             logger.info(f"✓ Generated embeddings in {generation_time:.2f}s")
             logger.info(f"  Embedding dimensions: {chunks[0]['embedding_dim']}")
             
@@ -247,59 +348,62 @@ def save_output(output_dir: Path, filename: str, markdown: str, chunks: List[Dic
     """Save markdown and chunks to output directory"""
     output_dir.mkdir(parents=True, exist_ok=True)
     
-    # Save markdown
+    # Save markdown (as bytes, so it matches what the worker uploads on
+    # every platform)
     markdown_path = output_dir / f"{filename}.md"
-    with open(markdown_path, "w", encoding="utf-8") as f:
-        f.write(markdown)
+    markdown_path.write_bytes(markdown.encode("utf-8"))
     logger.info(f"✓ Saved markdown: {markdown_path}")
     
-    # Save chunks (without embeddings for readability)
-    chunks_for_save = []
-    for chunk in chunks:
-        chunk_copy = chunk.copy()
-        if "embedding" in chunk_copy:
-            chunk_copy["embedding"] = f"<{len(chunk_copy['embedding'])} dimensions>"
-        chunks_for_save.append(chunk_copy)
-    
+    # Save chunks (without embeddings for readability). Embeddings are
+    # float32 arrays, which json hands to default(), so they are summarized
+    # while writing instead of on a copy of every chunk
     chunks_path = output_dir / f"{filename}_chunks.json"
-    with open(chunks_path, "w", encoding="utf-8") as f:
-        json.dump(chunks_for_save, f, indent=2, ensure_ascii=False)
+    
+    def summarize_embedding(embedding: array) -> str:
+        return f"<{len(embedding)} dimensions>"
+    
+    if ORJSON_AVAILABLE:
+        # Encoded in C straight to UTF-8 bytes
+        with open(chunks_path, "wb") as f:
+            f.write(orjson.dumps(chunks, default=summarize_embedding, option=orjson.OPT_INDENT_2))
+    else:
+        with open(chunks_path, "w", encoding="utf-8") as f:
+            json.dump(chunks, f, indent=2, ensure_ascii=False, default=summarize_embedding)
     logger.info(f"✓ Saved chunks: {chunks_path}")
     
-    # Save summary
+    # Save summary, built in memory and written at once
+    token_counts = [c["token_count"] for c in chunks]
+    char_counts = [c["char_count"] for c in chunks]
+    chunk_types = Counter(c["chunk_type"] for c in chunks)
+    
+    summary = [
+        f"Document Processing Summary\n",
+        f"{'='*50}\n\n",
+        f"File: {filename}\n",
+        f"Markdown length: {len(markdown):,} characters\n",
+        f"Number of chunks: {len(chunks)}\n\n",
+        f"Chunk Statistics:\n",
+        f"-" * 50 + "\n",
+        f"  Token count - min: {min(token_counts)}, max: {max(token_counts)}, avg: {sum(token_counts)/len(token_counts):.1f}\n",
+        f"  Char count - min: {min(char_counts)}, max: {max(char_counts)}, avg: {sum(char_counts)/len(char_counts):.1f}\n\n",
+        f"Chunk type distribution:\n"
+    ]
+    for chunk_type, count in sorted(chunk_types.items()):
+        summary.append(f"  {chunk_type}: {count}\n")
+    
+    summary.append(f"\n{'='*50}\n")
+    summary.append(f"\nFirst 3 chunks preview:\n")
+    summary.append(f"{'-'*50}\n\n")
+    for i, chunk in enumerate(chunks[:3]):
+        preview = chunk['content'][:500]
+        if len(chunk['content']) > 500:
+            preview += "..."
+        summary.append(f"Chunk {i} ({chunk['chunk_type']}, {chunk['token_count']} tokens):\n")
+        summary.append(f"{preview}\n\n")
+        summary.append(f"{'-'*50}\n\n")
+    
     summary_path = output_dir / f"{filename}_summary.txt"
-    with open(summary_path, "w", encoding="utf-8") as f:
-        f.write(f"Document Processing Summary\n")
-        f.write(f"{'='*50}\n\n")
-        f.write(f"File: {filename}\n")
-        f.write(f"Markdown length: {len(markdown):,} characters\n")
-        f.write(f"Number of chunks: {len(chunks)}\n\n")
-        
-        f.write(f"Chunk Statistics:\n")
-        f.write(f"-" * 50 + "\n")
-        token_counts = [c["token_count"] for c in chunks]
-        f.write(f"  Token count - min: {min(token_counts)}, max: {max(token_counts)}, avg: {sum(token_counts)/len(token_counts):.1f}\n")
-        
-        char_counts = [c["char_count"] for c in chunks]
-        f.write(f"  Char count - min: {min(char_counts)}, max: {max(char_counts)}, avg: {sum(char_counts)/len(char_counts):.1f}\n\n")
-        
-        chunk_types = {}
-        for c in chunks:
-            chunk_types[c["chunk_type"]] = chunk_types.get(c["chunk_type"], 0) + 1
-        f.write(f"Chunk type distribution:\n")
-        for chunk_type, count in sorted(chunk_types.items()):
-            f.write(f"  {chunk_type}: {count}\n")
-        
-        f.write(f"\n{'='*50}\n")
-        f.write(f"\nFirst 3 chunks preview:\n")
-        f.write(f"{'-'*50}\n\n")
-        for i, chunk in enumerate(chunks[:3]):
-            f.write(f"Chunk {i} ({chunk['chunk_type']}, {chunk['token_count']} tokens):\n")
-            preview = chunk['content'][:500]
-            if len(chunk['content']) > 500:
-                preview += "..."
-            f.write(f"{preview}\n\n")
-            f.write(f"{'-'*50}\n\n")
+    summary_path.write_text("".join(summary), encoding="utf-8")
     
     logger.info(f"✓ Saved summary: {summary_path}")
 
@@ -331,6 +435,11 @@ def main():
         default=50,
         help="Chunk overlap in tokens (default: 50)"
     )
+    parser.add_argument(
+        "--no-ocr",
+        action="store_true",
+        help="Skip OCR for PDFs (faster; the worker always runs OCR)"
+    )
     parser.add_argument(
         "--with-embeddings",
         action="store_true",
@@ -367,7 +476,11 @@ def main():
         chunk_size=args.chunk_size,
         chunk_overlap=args.chunk_overlap,
         openai_api_key=openai_key,
-        azure_endpoint=azure_endpoint
+        azure_endpoint=azure_endpoint,
+        embedding_batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", "16")),
+        embedding_concurrency=int(os.getenv("EMBEDDING_CONCURRENCY", "8")),
+        do_ocr=not args.no_ocr,
+        min_chunk_tokens=int(os.getenv("MIN_CHUNK_TOKENS", "100"))
     )
     
     # Convert to markdown